@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""startup time benchmark for sparqlcli
+
+Measures the time to import the module and to run a piped one-shot query against
+testdata/demo.nt, and checks which heavy dependencies the one-shot path imports.
+Exits with a non-zero status if a limit is exceeded, so it can guard CI runs.
+"""
+import sys
+import os
+import argparse
+import json
+import statistics
+import subprocess
+import time
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEMO_FILE = os.path.join(REPO_PATH, "testdata", "demo.nt")
+DEMO_QUERY = "SELECT ?s ?p ?o WHERE { ?s ?p ?o }"
+
+# modules a piped query against a local file must not import
+REPL_ONLY_MODULES = ["rich", "readline", "SPARQLWrapper", "requests"]
+
+MODULE_PROBE = """
+import sys, json, runpy
+sys.argv = ["sparqlcli", {demo_file!r}, "--output=csv", "--no-daemon"]
+try:
+    runpy.run_path({script!r}, run_name="__main__")
+except SystemExit:
+    pass
+print(json.dumps(sorted(set(module.split(".")[0] for module in sys.modules))), file=sys.stderr)
+"""
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="sparqlcli startup benchmark")
+    parser.add_argument('-n', '--repeat', type=int, default=10,
+                        help='number of runs per measurement (default: 10)')
+    parser.add_argument('--max-import-seconds', type=float, default=None,
+                        help='fail if the median import time exceeds this limit')
+    parser.add_argument('--max-query-seconds', type=float, default=None,
+                        help='fail if the median one-shot query time exceeds this limit')
+    parser.add_argument('--json', action='store_true', default=False,
+                        help='print results as json')
+    return parser.parse_args()
+
+def timed_run(cmd, stdin_data=""):
+    start = time.perf_counter()
+    subprocess.run(cmd, input=stdin_data, text=True, cwd=REPO_PATH, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def measure(cmd, repeat, stdin_data=""):
+    durations = [timed_run(cmd, stdin_data) for _ in range(repeat)]
+    return {"min": min(durations), "median": statistics.median(durations), "max": max(durations)}
+
+def imported_modules():
+    probe = MODULE_PROBE.format(demo_file=DEMO_FILE, script=os.path.join(REPO_PATH, "sparqlcli.py"))
+    result = subprocess.run([sys.executable, "-c", probe], input=DEMO_QUERY, text=True,
+                            cwd=REPO_PATH, check=True, capture_output=True)
+    return json.loads(result.stderr.strip().splitlines()[-1])
+
+def main():
+    args = parse_args()
+
+    results = {
+        "interpreter": measure([sys.executable, "-c", "pass"], args.repeat),
+        "import": measure([sys.executable, "-c", "import sparqlcli"], args.repeat),
+        "query": measure([sys.executable, "sparqlcli.py", DEMO_FILE, "--output=csv", "--no-daemon"],
+                         args.repeat, DEMO_QUERY),
+    }
+    unexpected_modules = [module for module in imported_modules() if module in REPL_ONLY_MODULES]
+    results["unexpected_modules"] = unexpected_modules
+
+    failures = []
+    if unexpected_modules:
+        failures.append(f"one-shot query imports {', '.join(unexpected_modules)}")
+    if args.max_import_seconds is not None and results["import"]["median"] > args.max_import_seconds:
+        failures.append(f"import takes {results['import']['median']:.3f}s > {args.max_import_seconds:.3f}s")
+    if args.max_query_seconds is not None and results["query"]["median"] > args.max_query_seconds:
+        failures.append(f"one-shot query takes {results['query']['median']:.3f}s > {args.max_query_seconds:.3f}s")
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name in ["interpreter", "import", "query"]:
+            timing = results[name]
+            print(f"{name:12} min {timing['min']:.3f}s  median {timing['median']:.3f}s  max {timing['max']:.3f}s")
+        print(f"{'modules':12} {'ok' if not unexpected_modules else 'unexpected: ' + ', '.join(unexpected_modules)}")
+
+    for failure in failures:
+        print("[failed]", failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
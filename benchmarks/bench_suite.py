@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+"""load, query, rendering and completion benchmarks for sparqlcli
+
+Scenarios:
+  load      loads a generated dataset in a fresh sparqlcli process per store, reports the
+            parse time and the peak resident memory of that process
+  query     runs local queries in-process against a loaded dataset, reports the time of
+            every query phase (parse, evaluate, convert, render) per output format and the
+            peak memory allocated while the query runs
+  remote    runs queries of several result sizes against the stand-in endpoint of
+            sparql_server.py, reports the request, network, decode, convert and render phases
+  complete  tab completion with a full set of result-derived completion candidates
+
+Datasets are generated by datasets.py on first use. --json writes the report to a file,
+--compare prints the change against an earlier report and fails if a benchmark got
+slower than --max-regression allows.
+"""
+import sys
+import os
+import argparse
+import contextlib
+import io
+import json
+import platform
+import re
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+BENCH_PATH = os.path.dirname(os.path.abspath(__file__))
+REPO_PATH = os.path.dirname(BENCH_PATH)
+sys.path.insert(0, REPO_PATH)
+
+import datasets
+
+NAMESPACE = datasets.NAMESPACE
+LOAD_QUERY = "SELECT (COUNT(*) AS ?triples) WHERE { ?s ?p ?o }"
+LOCAL_QUERIES = {
+    "scan": "SELECT ?s ?p ?o WHERE { ?s ?p ?o } LIMIT 10000",
+    "class": f"SELECT ?s ?label WHERE {{ ?s a <{NAMESPACE}Class3> ; <{NAMESPACE}label> ?label }}",
+    "join": f"SELECT ?s ?target ?value WHERE {{ ?s <{NAMESPACE}links> ?target . ?target <{NAMESPACE}value> ?value }} LIMIT 10000",
+    "aggregate": "SELECT ?class (COUNT(?s) AS ?count) WHERE { ?s a ?class } GROUP BY ?class",
+    "filter": f"SELECT ?s ?value WHERE {{ ?s <{NAMESPACE}value> ?value FILTER(?value < 1000) }}",
+}
+REMOTE_ROWS = [1000, 10000, 100000]
+COMPLETION_OPTION_COUNT = 100_000
+COMPLETION_PREFIXES = ["", "S", "<http", f"<{NAMESPACE}entity/4", "entity 12", "zzz"]
+SCENARIOS = ["load", "query", "remote", "complete"]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="sparqlcli benchmark suite")
+    parser.add_argument('--scenarios', default=",".join(SCENARIOS),
+                        help=f'comma separated scenarios to run (default: {",".join(SCENARIOS)})')
+    parser.add_argument('--scales', default="10k,100k",
+                        help=f'comma separated dataset scales out of {",".join(datasets.SCALES.keys())} (default: 10k,100k)')
+    parser.add_argument('--stores', default="memory,compact",
+                        help='comma separated stores for the load scenario (default: memory,compact)')
+    parser.add_argument('--formats', default="csv,table",
+                        help='comma separated output formats for the query scenario (default: csv,table)')
+    parser.add_argument('--remote-formats', default="json,xml",
+                        help='comma separated result formats for the remote scenario (default: json,xml)')
+    parser.add_argument('-n', '--repeat', type=int, default=3,
+                        help='timed runs per benchmark, the median is reported (default: 3)')
+    parser.add_argument('--data-dir', default=datasets.DEFAULT_DATA_DIR,
+                        help=f'directory for generated datasets (default: {datasets.DEFAULT_DATA_DIR})')
+    parser.add_argument('--json', default=None,
+                        help='write the report to this file')
+    parser.add_argument('--compare', default=None,
+                        help='report of an earlier run to compare against')
+    parser.add_argument('--max-regression', type=float, default=None,
+                        help='fail if a benchmark is this many percent slower than in --compare')
+    return parser.parse_args()
+
+def peak_rss_mib(rusage):
+    # kilobytes on linux, bytes on macOS
+    return rusage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+def run_load(filename, store):
+    cmd = [sys.executable, os.path.join(REPO_PATH, "sparqlcli.py"), filename,
+           "--no-daemon", "--output=csv", "--store", store]
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            cwd=REPO_PATH, text=True)
+    proc.stdin.write(LOAD_QUERY)
+    proc.stdin.close()
+    stderr = proc.stderr.read()
+    # wait4 reports the resource usage of this child alone
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise Exception(f"{' '.join(cmd)} failed: {stderr.strip()}")
+
+    parsed = re.search(r"complete, (\d+) triples in ([\d.]+)s", stderr)
+    return {"seconds": float(parsed.group(2)), "wall_seconds": wall,
+            "triples": int(parsed.group(1)), "peak_rss_mib": peak_rss_mib(rusage)}
+
+def init_sparqlcli(cli_args):
+    """configures the sparqlcli module globals the way a command line run would"""
+    import sparqlcli
+    sys_argv = sys.argv
+    sys.argv = ["sparqlcli"] + cli_args + ["--no-daemon"]
+    try:
+        sparqlcli.args, sparqlcli.prefix_args = sparqlcli.parse_args()
+    finally:
+        sys.argv = sys_argv
+    sparqlcli.args.interactive = False
+    with contextlib.redirect_stderr(io.StringIO()):
+        sparqlcli.init_endpoint()
+    return sparqlcli
+
+def run_query(sparqlcli, query, output_format):
+    sparqlcli.args.output = output_format
+    timer = sparqlcli.QueryTimer()
+    sparqlcli.query_timers.timer = timer
+    try:
+        with open(os.devnull, "wt") as devnull, contextlib.redirect_stderr(devnull):
+            sparqlcli.execute_query(query, devnull)
+    finally:
+        sparqlcli.query_timers.timer = None
+    return timer.total(), dict(timer.phases), timer.rows
+
+def measure_query(sparqlcli, query, output_format, repeat):
+    # the first run imports the query engine and is not counted
+    run_query(sparqlcli, query, output_format)
+    runs = [run_query(sparqlcli, query, output_format) for _ in range(repeat)]
+    median_idx = sorted(range(len(runs)), key=lambda run_idx: runs[run_idx][0])[len(runs) // 2]
+    seconds, phases, rows = runs[median_idx]
+
+    tracemalloc.start()
+    try:
+        run_query(sparqlcli, query, output_format)
+        peak_alloc = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"seconds": seconds, "phases": phases, "rows": rows, "peak_alloc_mib": peak_alloc / 1024 / 1024}
+
+def bench_load(args, scales):
+    results = []
+    for scale in scales:
+        filename = datasets.dataset_path(args.data_dir, scale)
+        for store in args.stores.split(","):
+            runs = [run_load(filename, store) for _ in range(args.repeat)]
+            result = sorted(runs, key=lambda run: run["seconds"])[len(runs) // 2]
+            results.append(dict(result, scenario="load", name=f"{scale}/{store}"))
+            print_result(results[-1])
+    return results
+
+def bench_query(args, scales):
+    results = []
+    for scale in scales:
+        sparqlcli = init_sparqlcli([datasets.dataset_path(args.data_dir, scale), "--query-cache-size", "0"])
+        for query_name, query in LOCAL_QUERIES.items():
+            for output_format in args.formats.split(","):
+                result = measure_query(sparqlcli, query, output_format, args.repeat)
+                results.append(dict(result, scenario="query", name=f"{scale}/{query_name}/{output_format}"))
+                print_result(results[-1])
+    return results
+
+def bench_remote(args):
+    results = []
+    server = subprocess.Popen([sys.executable, os.path.join(BENCH_PATH, "sparql_server.py")],
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        endpoint = server.stdout.readline().strip()
+        for remote_format in args.remote_formats.split(","):
+            sparqlcli = init_sparqlcli([endpoint, "--remote-format", remote_format])
+            for row_count in REMOTE_ROWS:
+                query = f"SELECT ?s ?label ?value WHERE {{ ?s ?p ?o }} LIMIT {row_count}"
+                result = measure_query(sparqlcli, query, "csv", args.repeat)
+                results.append(dict(result, scenario="remote", name=f"{remote_format}/{row_count}"))
+                print_result(results[-1])
+    finally:
+        server.terminate()
+        server.wait()
+    return results
+
+def bench_complete(args):
+    import rdflib
+    import sparqlcli
+    sparqlcli.g = rdflib.Graph()
+    options = [f"<{NAMESPACE}entity/{option_idx}>" for option_idx in range(COMPLETION_OPTION_COUNT // 2)] + \
+              [f"entity {option_idx} alpha" for option_idx in range(COMPLETION_OPTION_COUNT // 2)]
+
+    add_runs = []
+    complete_runs = []
+    for _ in range(args.repeat):
+        completer = sparqlcli.SparqlCompleter()
+        start = time.perf_counter()
+        completer.add_dynamic_options(options)
+        add_runs.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for prefix in COMPLETION_PREFIXES:
+            # readline asks for one match per call until it gets None
+            for state in range(50):
+                if completer.complete(prefix, state) is None:
+                    break
+        complete_runs.append(time.perf_counter() - start)
+
+    results = [{"scenario": "complete", "name": f"add/{len(options)}", "seconds": statistics.median(add_runs)},
+               {"scenario": "complete", "name": f"lookup/{len(COMPLETION_PREFIXES)}",
+                "seconds": statistics.median(complete_runs)}]
+    for result in results:
+        print_result(result)
+    return results
+
+def result_key(result):
+    return f"{result['scenario']}/{result['name']}"
+
+def print_result(result, baseline=None):
+    memory = result.get("peak_rss_mib", result.get("peak_alloc_mib"))
+    details = ", ".join([f"{name} {seconds * 1000:.1f} ms" for name, seconds in result.get("phases", {}).items()])
+    if "triples" in result:
+        details = f"{result['triples']} triples"
+    change = ""
+    if baseline is not None:
+        change = f"{(result['seconds'] / max(baseline['seconds'], 1e-9) - 1) * 100:+7.1f}%  "
+    print(f"{result_key(result):40} {result['seconds']:9.4f}s  " + change +
+          (f"{memory:8.1f} MiB  " if memory is not None else " " * 14) + details, flush=True)
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_PATH, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "created": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+def compare(results, baseline_filename, max_regression):
+    with open(baseline_filename, "rt") as infile:
+        baseline = json.load(infile)
+    baseline_results = {result_key(result): result for result in baseline["results"]}
+    print(f"\ncompared to {baseline_filename} ({baseline['environment'].get('commit')})")
+
+    regressions = []
+    for result in results:
+        baseline_result = baseline_results.get(result_key(result))
+        if baseline_result is None:
+            continue
+        print_result(result, baseline_result)
+        change = (result["seconds"] / max(baseline_result["seconds"], 1e-9) - 1) * 100
+        if max_regression is not None and change > max_regression:
+            regressions.append(f"{result_key(result)} is {change:.1f}% slower")
+    return regressions
+
+def main():
+    args = parse_args()
+    scenarios = args.scenarios.split(",")
+    scales = args.scales.split(",")
+    for scale in scales:
+        if scale not in datasets.SCALES:
+            print(f"[failed] unknown scale {scale}", file=sys.stderr)
+            sys.exit(1)
+
+    results = []
+    if "load" in scenarios:
+        results += bench_load(args, scales)
+    if "query" in scenarios:
+        results += bench_query(args, scales)
+    if "remote" in scenarios:
+        results += bench_remote(args)
+    if "complete" in scenarios:
+        results += bench_complete(args)
+
+    if args.json is not None:
+        with open(args.json, "wt") as outfile:
+            json.dump({"environment": environment(), "results": results}, outfile, indent=2)
+
+    regressions = []
+    if args.compare is not None:
+        regressions = compare(results, args.compare, args.max_regression)
+    for regression in regressions:
+        print("[failed]", regression, file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
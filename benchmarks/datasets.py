@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""synthetic N-Triples datasets for the sparqlcli benchmarks
+
+Generates a deterministic graph of typed entities, each with a language-tagged label,
+an integer value, a date and a link to another entity. Link targets are skewed towards
+low entity numbers so a few entities are linked to very often, like in most real dumps.
+The same scale and seed always produce the same file.
+"""
+import sys
+import os
+import argparse
+import random
+
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000, "10m": 10_000_000}
+NAMESPACE = "http://bench.sparqlcli.example/"
+RDF_TYPE = "<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>"
+XSD = "http://www.w3.org/2001/XMLSchema#"
+CLASS_COUNT = 20
+TRIPLES_PER_ENTITY = 5
+DEFAULT_DATA_DIR = os.path.join("~", ".cache", "sparqlcli", "benchmarks")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="generate a synthetic N-Triples benchmark dataset")
+    parser.add_argument('scale', choices=list(SCALES.keys()),
+                        help='number of triples')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR,
+                        help=f'directory for generated datasets (default: {DEFAULT_DATA_DIR})')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='random seed (default: 1)')
+    return parser.parse_args()
+
+def entity_triples(rng, entity_idx, entity_count):
+    subject = f"<{NAMESPACE}entity/{entity_idx}>"
+    link_target = int(entity_count * rng.random() ** 3)
+    yield f"{subject} {RDF_TYPE} <{NAMESPACE}Class{entity_idx % CLASS_COUNT}> .\n"
+    yield f'{subject} <{NAMESPACE}label> "entity {entity_idx} {rng.choice(["alpha", "beta", "gamma"])}"@en .\n'
+    yield f'{subject} <{NAMESPACE}value> "{rng.randint(0, 1_000_000)}"^^<{XSD}integer> .\n'
+    yield f'{subject} <{NAMESPACE}created> "20{rng.randint(10, 29)}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}"^^<{XSD}date> .\n'
+    yield f"{subject} <{NAMESPACE}links> <{NAMESPACE}entity/{link_target}> .\n"
+
+def generate(filename, triple_count, seed=1):
+    rng = random.Random(seed)
+    entity_count = max(triple_count // TRIPLES_PER_ENTITY, 1)
+    written = 0
+    with open(filename + ".tmp", "wt", encoding="utf-8") as outfile:
+        for entity_idx in range(entity_count + 1):
+            for triple in entity_triples(rng, entity_idx, entity_count):
+                if written >= triple_count:
+                    break
+                outfile.write(triple)
+                written += 1
+    os.replace(filename + ".tmp", filename)
+    return written
+
+def dataset_path(data_dir, scale, seed=1):
+    """path of the dataset for a scale, generated on first use"""
+    data_dir = os.path.expanduser(data_dir)
+    os.makedirs(data_dir, exist_ok=True)
+    filename = os.path.join(data_dir, f"bench-{scale}-{seed}.nt")
+    if not os.path.exists(filename):
+        print(f"[dataset] generating {scale} triples in {filename}", file=sys.stderr)
+        generate(filename, SCALES[scale], seed)
+    return filename
+
+def main():
+    args = parse_args()
+    print(dataset_path(args.data_dir, args.scale, args.seed))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""stand-in SPARQL endpoint for the sparqlcli remote benchmarks
+
+Answers every SELECT query with synthetic rows instead of evaluating it, so a benchmark
+measures the client and not the server. The number of rows is the query's LIMIT (or
+--rows without one) and OFFSET is honoured, which keeps paged requests consistent.
+Results are sent as SPARQL JSON or XML depending on the Accept header, gzip compressed
+if the client accepts it.
+"""
+import sys
+import argparse
+import gzip
+import json
+import re
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+NAMESPACE = "http://bench.sparqlcli.example/"
+COLUMNS = ["s", "label", "value"]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="stand-in SPARQL endpoint for benchmarks")
+    parser.add_argument('--port', type=int, default=0,
+                        help='port to listen on (default: any free port)')
+    parser.add_argument('--rows', type=int, default=1000,
+                        help='rows returned for queries without a LIMIT (default: 1000)')
+    return parser.parse_args()
+
+def result_window(query, default_rows):
+    limit = re.search(r"\bLIMIT\s+(\d+)", query, re.IGNORECASE)
+    offset = re.search(r"\bOFFSET\s+(\d+)", query, re.IGNORECASE)
+    return (int(offset.group(1)) if offset else 0), (int(limit.group(1)) if limit else default_rows)
+
+def result_row(row_idx):
+    return {"s": {"type": "uri", "value": f"{NAMESPACE}entity/{row_idx}"},
+            "label": {"type": "literal", "xml:lang": "en", "value": f"entity {row_idx}"},
+            "value": {"type": "literal", "datatype": "http://www.w3.org/2001/XMLSchema#integer",
+                      "value": str(row_idx * 7 % 1000003)}}
+
+def json_body(offset, limit):
+    rows = ",".join([json.dumps(result_row(row_idx)) for row_idx in range(offset, offset + limit)])
+    return '{"head": {"vars": ' + json.dumps(COLUMNS) + '}, "results": {"bindings": [' + rows + ']}}'
+
+def xml_binding(name, term):
+    if term["type"] == "uri":
+        return f'<binding name="{name}"><uri>{escape(term["value"])}</uri></binding>'
+    attributes = ""
+    if "xml:lang" in term:
+        attributes = f' xml:lang="{term["xml:lang"]}"'
+    elif "datatype" in term:
+        attributes = f' datatype="{term["datatype"]}"'
+    return f'<binding name="{name}"><literal{attributes}>{escape(term["value"])}</literal></binding>'
+
+def xml_body(offset, limit):
+    rows = []
+    for row_idx in range(offset, offset + limit):
+        row = result_row(row_idx)
+        rows.append("<result>" + "".join([xml_binding(name, row[name]) for name in COLUMNS]) + "</result>")
+    head = "".join([f'<variable name="{name}"/>' for name in COLUMNS])
+    return '<?xml version="1.0"?><sparql xmlns="http://www.w3.org/2005/sparql-results#">' + \
+        f"<head>{head}</head><results>{''.join(rows)}</results></sparql>"
+
+class SparqlHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    default_rows = 1000
+
+    def log_message(self, format, *args):
+        pass
+
+    def answer(self, query):
+        offset, limit = result_window(query, self.default_rows)
+        if "xml" in self.headers.get("Accept", "") and "json" not in self.headers.get("Accept", ""):
+            content_type, body = "application/sparql-results+xml", xml_body(offset, limit)
+        else:
+            content_type, body = "application/sparql-results+json", json_body(offset, limit)
+        body = body.encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=1)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        self.answer(params.get("query", [""])[0])
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+        params = urllib.parse.parse_qs(body)
+        self.answer(params.get("query", [body])[0])
+
+def start_server(port=0, default_rows=1000):
+    """serves from a background thread, returns the server and the endpoint url"""
+    handler = type("Handler", (SparqlHandler,), {"default_rows": default_rows})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/sparql"
+
+def main():
+    args = parse_args()
+    server, url = start_server(args.port, args.rows)
+    print(url, flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
+
+if __name__ == "__main__":
+    main()
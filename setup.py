@@ -13,7 +13,7 @@ setup(
     author_email='git@frankgrimm.net',
     version='1.0',
     url='http://github.com/FrankGrimm/sparqlcli',
-    py_modules=['sparqlcli'],
+    py_modules=['sparqlcli', 'sparqlcli_store', 'sparqlcli_scan'],
     description='SPARQL CLI client',
     long_description="",
     entry_points={
@@ -23,6 +23,10 @@ setup(
     },
     zip_safe=False,
     install_requires=install_requires,
+    extras_require={
+        # persistent store for --graph-cache, needs the Berkeley DB library
+        'graph-cache': ['berkeleydb'],
+    },
     classifiers=[
         'Programming Language :: Python'
     ]
@@ -3,26 +3,88 @@ import sys
 import os
 import argparse
 import atexit
-import readline
 import tempfile
 import subprocess
 import json
+import textwrap
+import codecs
+import itertools
+import collections
+import re
 import time
+import hashlib
+import pickle
+import shutil
+import socket
+import signal
+import shlex
+import threading
+import io
+import glob
+import contextlib
+import bisect
+import array
 try:
     from urlparse import urlparse
 except:
     from urllib.parse import urlparse
 
-import rdflib
-import SPARQLWrapper as sparqlw
-
-import rich
-import rich.syntax
-import rich.console
-import rich.traceback
+# rdflib, SPARQLWrapper, requests, rich, readline and the concurrency modules are
+# imported by the code paths that use them, a piped query does not pay for the REPL
+# or remote machinery
 
+HIST_DB_PATH = "~/.config/sparqlcli/history.sqlite"
+# flat history file of earlier versions, imported when the database is created
 HIST_PATH = "~/.config/sparqlcli/sparqlcli.history"
 HIST_CRLF = "<<CRLF>>"
+# recent queries handed to readline for the arrow keys and Ctrl-R, older ones are found with .history
+HIST_WINDOW = 1000
+HIST_SEARCH_LIMIT = 20
+CACHE_PATH = "~/.cache/sparqlcli"
+SPARQL_RESULTS_NS = "{http://www.w3.org/2005/sparql-results#}"
+NOCACHE_HINT = re.compile(r"^\s*#\s*nocache\b", re.IGNORECASE | re.MULTILINE)
+QNAME_LOCAL = re.compile(r"^(?:[\w\-]|[\w\-][\w\-.]*[\w\-])?$")
+LINE_FORMATS = ["nt", "nquads"]
+# formats with named graphs, these need a context aware store
+QUAD_FORMATS = ["nquads", "trix", "trig"]
+COMPRESSION_EXTENSIONS = [".gz", ".bz2", ".xz"]
+PARALLEL_LOAD_MIN_SIZE = 32 * 1024 * 1024
+PARALLEL_LOAD_MAX_CHUNK = 64 * 1024 * 1024
+QUERY_TOKEN = re.compile(r'("""(?:[^"\\]|\\.|"(?!""))*"""|\'\'\'(?:[^\'\\]|\\.|\'(?!\'\'))*\'\'\'|' + \
+                         r'"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\'|<[^<>"{}|^`\\\s]*>|#[^\n]*)|\s+')
+QUERY_FORM = re.compile(r"\b(SELECT|CONSTRUCT|DESCRIBE|ASK)\b", re.IGNORECASE)
+GRAPH_QUERY_FORMS = ["CONSTRUCT", "DESCRIBE"]
+GRAPH_OUTPUTS = ["nt", "nquads", "turtle"]
+# N-Triples first, it can be passed through or parsed line by line while it arrives
+GRAPH_ACCEPT = "application/n-triples, text/plain;q=0.9, text/turtle;q=0.5, application/rdf+xml;q=0.3"
+GRAPH_CONTENT_FORMATS = {"turtle": "turtle", "n3": "n3", "rdf+xml": "xml", "ld+json": "json-ld", "trig": "trig"}
+READ_SIZE = 64 * 1024
+# rows a federated source collects before handing them over, sent earlier when the output waits
+FEDERATION_BATCH_SIZE = 256
+FEDERATION_QUEUE_SIZE = 64
+PAGER_CHROME_LINES = 7
+WATCH_DEBOUNCE = 0.05
+# longest wait for a quiet period, e.g. when another program keeps writing into a watched directory
+WATCH_DEBOUNCE_MAX = 1.0
+WATCH_POLL_INTERVAL = 0.5
+# seconds a cancelled query worker gets to stop before it is abandoned
+QUERY_CANCEL_GRACE = 2.0
+# a request is registered with its query worker once the response headers arrive, until then
+# its read timeout ends the wait, slightly after the deadline so that the worker is cancelled first
+QUERY_DEADLINE_SLACK = 0.25
+VOCABULARY_PAGE_SIZE = 1000
+# "# nocache" keeps the pages out of the result cache, the vocabulary has its own cache file
+# the pages are only consistent with a fixed order, without ORDER BY terms can be skipped or repeated
+VOCABULARY_QUERIES = {"classes": "# nocache\nSELECT DISTINCT ?term WHERE { [] a ?term } ORDER BY ?term",
+                      "predicates": "# nocache\nSELECT DISTINCT ?term WHERE { [] ?term [] } ORDER BY ?term"}
+# estimated bytes per completion entry on top of the string itself (index tuple, statistics)
+COMPLETION_ENTRY_OVERHEAD = 240
+COMPLETION_HALF_LIFE = 50
+COMPLETION_MAX_MATCHES = 1000
+# context of the persistent cache graph, a graph without an identifier gets a new blank node
+# on every run and would not see the triples stored under the previous one
+GRAPH_CACHE_IDENTIFIER = "urn:sparqlcli:graph-cache"
+TRAILING_LIMIT_OFFSET = re.compile(r"(\s+(LIMIT|OFFSET)\s+\d+)+\s*$", re.IGNORECASE)
 
 args = None
 console = None
@@ -40,6 +102,7 @@ def fprint(catarg, *pargs, **kwargs):
             catarg = catarg[1:]
         print(catarg, *pargs, **kwargs, file=sys.stderr)
     else:
+        import rich
         rich.print(catarg, *pargs, **kwargs, file=sys.stderr)
 
 def vprint(*pargs, **kwargs):
@@ -69,10 +132,56 @@ def spawn_editor(with_content=""):
         return editor_result
 
 query = None
+prefix_args = []
+
+def inner_filename(filename):
+    """filename without a compression extension, used to detect the RDF format"""
+    base_filename, extension = os.path.splitext(filename)
+    if extension.lower() in COMPRESSION_EXTENSIONS:
+        return base_filename
+    return filename
+
+def open_local(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == ".gz":
+        import gzip
+        return gzip.open(filename, "rb")
+    elif extension == ".bz2":
+        import bz2
+        return bz2.open(filename, "rb")
+    elif extension == ".xz":
+        import lzma
+        return lzma.open(filename, "rb")
+    return open(filename, "rb")
+
+def expand_local_paths(paths):
+    """expands directories and glob patterns into a list of files"""
+    files = []
+    for path in paths:
+        path = os.path.expanduser(path)
+        if os.path.isdir(path):
+            import rdflib.util
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                files.extend([os.path.join(dirpath, filename) for filename in sorted(filenames) \
+                              if rdflib.util.guess_format(inner_filename(filename)) is not None])
+        elif any([glob_char in path for glob_char in "*?["]):
+            matches = [match for match in sorted(glob.glob(path, recursive=True)) if os.path.isfile(match)]
+            if len(matches) == 0:
+                raise argparse.ArgumentTypeError(f"no files match: {path}")
+            files.extend(matches)
+        elif os.path.exists(path):
+            files.append(path)
+        else:
+            raise argparse.ArgumentTypeError(f"file not found: {path}")
+
+    if len(files) == 0:
+        raise argparse.ArgumentTypeError(f"no RDF files found in: {' '.join(paths)}")
+    return files
 
 def parse_args():
     parser = argparse.ArgumentParser(description="sparqlcli client")
-    parser.add_argument('endpoint', help='filename or remote SPARQL endpoint')
+    parser.add_argument('endpoint', nargs='+', help='remote SPARQL endpoint, or local files, directories and glob patterns')
     parser.add_argument('-r', '--remote',
                         default=None,
                         required=False,
@@ -91,41 +200,231 @@ def parse_args():
                         default=None,
                         help='input format for local files (auto-detected if not specified)')
 
+    parser.add_argument('--load-workers',
+                        required=False,
+                        default=os.cpu_count() or 1,
+                        type=int,
+                        help='processes used to parse large nt/nquads files in parallel (default: number of CPUs)')
+
+    parser.add_argument('--store',
+                        required=False,
+                        default='memory',
+                        choices=['memory', 'compact'],
+                        help='store for local files, compact interns terms to integer ids and needs several times less memory but holds a single graph (default: memory)')
+
     parser.add_argument('-o', '--output',
                         required=False,
                         default='table',
-                        choices=['table', 'json', 'csv'],
-                        help='output format')
+                        choices=['table', 'json', 'ndjson', 'csv'] + GRAPH_OUTPUTS,
+                        help='output format, nt, nquads and turtle are for CONSTRUCT and DESCRIBE queries')
+
+    parser.add_argument('--output-file',
+                        required=False,
+                        default=None,
+                        help='write the result of a piped query to this file instead of stdout')
+
+    parser.add_argument('--scan', action='store_true', default=False,
+                        help='answer simple SELECT queries on uncompressed nt/nquads files from a block index of the memory-mapped files, other queries load the files on first use')
+
+    parser.add_argument('--query-cache-size',
+                        required=False,
+                        default=128,
+                        type=int,
+                        help='number of parsed local queries kept for repeated runs, 0 disables the cache (default: 128)')
+
+    parser.add_argument('--max-rows',
+                        required=False,
+                        default=1000,
+                        type=int,
+                        help='rows shown in table output outside of the pager, the rest is counted, 0 shows all rows (default: 1000)')
+
+    parser.add_argument('--no-pager', action='store_true', default=False,
+                        help='print large interactive table results at once instead of paging through them')
+
+    parser.add_argument('--completion-memory',
+                        required=False,
+                        default=64,
+                        type=float,
+                        help='memory for result values offered by tab completion in MiB, rarely and long ago seen values are evicted first (default: 64)')
+
+    parser.add_argument('--vocabulary', action='store_true', default=False,
+                        help='fetch the classes and predicates of the endpoint in the background for tab completion in interactive mode, cached per endpoint')
+
+    parser.add_argument('--vocabulary-limit',
+                        required=False,
+                        default=10000,
+                        type=int,
+                        help='maximum number of classes and of predicates fetched for tab completion (default: 10000)')
+
+    parser.add_argument('--remote-format',
+                        required=False,
+                        default='json',
+                        choices=['json', 'xml'],
+                        help='result format requested from remote endpoints (default: json)')
+
+    parser.add_argument('--result-cache-ttl',
+                        required=False,
+                        default=0,
+                        type=float,
+                        help='cache remote results for this many seconds, a "# nocache" comment line bypasses the cache (default: 0, disabled)')
+
+    parser.add_argument('--result-cache-size',
+                        required=False,
+                        default=64,
+                        type=float,
+                        help='size limit of the remote result cache in MiB, least recently used results are evicted first (default: 64)')
+
+    parser.add_argument('--result-cache-disk', action='store_true', default=False,
+                        help='keep cached remote results in the cache directory across runs')
+
+    parser.add_argument('--page-size',
+                        required=False,
+                        default=0,
+                        type=int,
+                        help='split ordered remote SELECT queries into LIMIT/OFFSET pages of this size (default: 0, disabled)')
+
+    parser.add_argument('--page-workers',
+                        required=False,
+                        default=4,
+                        type=int,
+                        help='number of pages fetched concurrently with --page-size (default: 4)')
+
+    parser.add_argument('--batch',
+                        required=False,
+                        default=None,
+                        help='run all queries from a file (separated by empty lines) or all .sparql files in a directory concurrently')
+
+    parser.add_argument('--batch-output',
+                        required=False,
+                        default='sparqlcli-batch',
+                        help='directory for per-query result files and summary.json in batch mode (default: sparqlcli-batch)')
+
+    parser.add_argument('--batch-workers',
+                        required=False,
+                        default=os.cpu_count() or 1,
+                        type=int,
+                        help='number of queries executed concurrently in batch mode (default: number of CPUs)')
+
+    parser.add_argument('--timeout',
+                        required=False,
+                        default=0,
+                        type=float,
+                        help='cancel queries that run longer than this many seconds, 0 disables (default: 0, change with .timeout in interactive mode)')
+
+    parser.add_argument('--http-timeout',
+                        required=False,
+                        default=None,
+                        type=float,
+                        help='timeout in seconds for connecting to and reading from remote endpoints (default: none)')
+
+    parser.add_argument('--http-retries',
+                        required=False,
+                        default=3,
+                        type=int,
+                        help='retries for failed connections and 429/502/503/504 responses from remote endpoints (default: 3)')
+
+    parser.add_argument('--http-backoff',
+                        required=False,
+                        default=0.5,
+                        type=float,
+                        help='backoff factor in seconds between retries, doubled on every retry (default: 0.5)')
 
     parser.add_argument("-v", "--verbose", action='store_true', default=False,
                         help="enable verbose output")
 
+    parser.add_argument('--timing', action='store_true', default=False,
+                        help='print the time spent in each query phase (toggle with .timing in interactive mode)')
+
+    parser.add_argument('--metrics', action='store_true', default=False,
+                        help='write one JSON line with timings and row count per query to stderr')
+
+    parser.add_argument('--profile',
+                        required=False,
+                        default=None,
+                        help='profile queries with cProfile and write the statistics to this file (pstats format)')
+
+    parser.add_argument('--graph-cache', action='store_true', default=False,
+                        help='keep a parsed copy of local files in the cache directory and reuse it while the file is unchanged')
+
+    parser.add_argument('--cache-dir',
+                        required=False,
+                        default=CACHE_PATH,
+                        help=f'cache directory (default: {CACHE_PATH})')
+
+    parser.add_argument('--graph-cache-keep',
+                        required=False,
+                        default=3,
+                        type=int,
+                        help='number of cached graphs to keep, least recently used graphs are evicted first (default: 3)')
+
+    parser.add_argument('--serve', action='store_true', default=False,
+                        help='load the endpoint once and answer queries from other sparqlcli processes over a unix socket')
+
+    parser.add_argument('--socket',
+                        required=False,
+                        default=None,
+                        help='unix socket path for --serve and for forwarding queries (default: derived from endpoint in the cache directory)')
+
+    parser.add_argument('--no-daemon', action='store_true', default=False,
+                        help='never forward queries to a running daemon')
+
+    parser.add_argument('--federate', action='store_true', default=False,
+                        help='query each endpoint argument as a separate source, also when all of them are local files')
+
+    parser.add_argument('--dedup', action='store_true', default=False,
+                        help='with several sources, drop rows that an earlier source already returned')
+
     args, prefix_args = parser.parse_known_args()
+    args.endpoints = args.endpoint
+    args.endpoint = args.endpoints[0]
+    remote_endpoints = [endpoint for endpoint in args.endpoints if args.remote or is_url(endpoint)]
+    # several remote endpoints, or remote endpoints and local files, are queried side by side
+    args.federated = len(args.endpoints) > 1 and (args.federate or len(remote_endpoints) > 0)
     if args.remote is None:
         args.remote = is_url(args.endpoint)
 
-    if not args.remote and not os.path.exists(args.endpoint):
-        raise argparse.ArgumentTypeError(f"file not found: {args.endpoint}")
+    if args.federated:
+        args.sources = [(endpoint, endpoint in remote_endpoints) for endpoint in args.endpoints]
+        args.remote = False
+        local_endpoints = [endpoint for endpoint, remote in args.sources if not remote]
+        args.files = expand_local_paths(local_endpoints) if len(local_endpoints) > 0 else []
+    elif args.remote:
+        args.files = []
+    else:
+        args.files = expand_local_paths(args.endpoints)
+
+    if args.scan and (args.remote or args.federated):
+        raise argparse.ArgumentTypeError("--scan needs local nt or nquads files")
 
-    if args.interactive is None:
+    if args.batch is not None and not os.path.exists(args.batch):
+        raise argparse.ArgumentTypeError(f"file not found: {args.batch}")
+
+    if args.serve or args.batch is not None:
+        args.interactive = False
+    elif args.interactive is None:
         args.interactive = hasattr(sys.stdin, 'isatty') and sys.stdin.isatty()
 
     return args, prefix_args
 
-try:
-    args, prefix_args = parse_args()
-except (argparse.ArgumentError, argparse.ArgumentTypeError) as arg_ex:
-    fprint("error", f"[red]\[error][/red] {arg_ex}")
-    sys.exit(1)
+def init_args():
+    global args, prefix_args, query
+    try:
+        args, prefix_args = parse_args()
+    except (argparse.ArgumentError, argparse.ArgumentTypeError) as arg_ex:
+        fprint("error", f"[red]\[error][/red] {arg_ex}")
+        sys.exit(1)
 
-if not args.interactive:
-    query = " ".join([line.rstrip() for line in sys.stdin]).strip()
-    vprint("\[query]", query)
+    if not args.interactive and not args.serve and args.batch is None:
+        # keep line breaks, a "#" comment would otherwise swallow the rest of the query
+        query = "\n".join([line.rstrip() for line in sys.stdin]).strip()
+        vprint("\[query]", query)
 
 prompt = "> "
 
-def add_namespace_params(g):
-    for namespace_param in prefix_args:
+def add_namespace_params(g, namespace_params=None):
+    if namespace_params is None:
+        namespace_params = prefix_args
+    for namespace_param in namespace_params:
         if not namespace_param.startswith("--") or not "=" in namespace_param:
             continue
         namespace_param = namespace_param[2:]
@@ -133,45 +432,945 @@ def add_namespace_params(g):
         namespace = namespace.strip()
         longform = longform.strip()
         g.namespace_manager.bind(namespace, longform)
+        invalidate_prefix_index()
+
+def graph_cache_options(args):
+    """arguments besides the files that change the graph of a cache entry"""
+    return [args.format, args.store]
+
+def graph_cache_key(args):
+    key_data = graph_cache_options(args)
+    for filename in args.files:
+        file_stat = os.stat(filename)
+        key_data.append([os.path.abspath(filename), file_stat.st_size, file_stat.st_mtime_ns])
+    source = ", ".join([os.path.abspath(filename) for filename in args.files])
+    return source, hashlib.sha1(json.dumps(key_data).encode("utf-8")).hexdigest()
+
+def graph_cache_entries(cache_root):
+    entries = []
+    if not os.path.isdir(cache_root):
+        return entries
+    for entry in os.listdir(cache_root):
+        meta_filename = os.path.join(cache_root, entry, "meta.json")
+        if not os.path.exists(meta_filename):
+            continue
+        try:
+            with open(meta_filename, "rt") as infile:
+                meta = json.load(infile)
+        except (OSError, ValueError):
+            continue
+        # the meta file is touched on every cache hit, its mtime is the last access time
+        entries.append((os.path.getmtime(meta_filename), entry, meta))
+    return entries
+
+def graph_cache_evict(cache_root, source, options, keep_count):
+    entries = sorted(graph_cache_entries(cache_root), key=lambda entry: entry[0], reverse=True)
+    for entry_idx, (_, entry, meta) in enumerate(entries):
+        # entries for an older version of the current source loaded the same way are never useful
+        # again, the same files loaded with another --format or --store are kept
+        if entry_idx >= keep_count or (meta.get("source") == source and meta.get("options") == options):
+            vprint("\[graph cache]", "evicting", meta.get("source", entry))
+            shutil.rmtree(os.path.join(cache_root, entry), ignore_errors=True)
+
+def graph_cache_open(cache_dir):
+    import rdflib
+    meta_filename = os.path.join(cache_dir, "meta.json")
+    if not os.path.exists(meta_filename):
+        return None
+
+    with open(meta_filename, "rt") as infile:
+        meta = json.load(infile)
+
+    if meta.get("store") == "BerkeleyDB":
+        g = rdflib.Graph(store="BerkeleyDB", identifier=rdflib.URIRef(meta.get("identifier", GRAPH_CACHE_IDENTIFIER)))
+        if g.open(os.path.join(cache_dir, "store"), create=False) != rdflib.store.VALID_STORE:
+            return None
+        atexit.register(g.close)
+    else:
+        pickle_warning()
+        with open(os.path.join(cache_dir, "graph.pickle"), "rb") as infile:
+            g = pickle.load(infile)
+
+    # an entry that does not return the triples it was built with is rebuilt
+    if len(g) != meta.get("triples"):
+        vprint("\[graph cache]", f"{cache_dir} returned {len(g)} of {meta.get('triples')} triples")
+        return None
+
+    os.utime(meta_filename)
+    return g
+
+def pickle_warning():
+    if args.store == "memory":
+        fprint("\[graph cache]", "pickled graph, opening it takes longer the larger it is; " + \
+               "install berkeleydb (the graph-cache extra) to open cached graphs in constant time")
+    else:
+        fprint("\[graph cache]", "pickled compact store, opening it takes longer the larger it is")
+
+def graph_cache_create(cache_dir):
+    import rdflib
+    import rdflib.plugins.stores.berkeleydb
+    os.makedirs(cache_dir, exist_ok=True)
+    # a persistent indexed store opens without reading the data, the pickle fallback
+    # still skips parsing but has to be deserialized completely
+    if rdflib.plugins.stores.berkeleydb.has_bsddb and args.store == "memory":
+        g = rdflib.Graph(store="BerkeleyDB", identifier=rdflib.URIRef(GRAPH_CACHE_IDENTIFIER))
+        g.open(os.path.join(cache_dir, "store"), create=True)
+        atexit.register(g.close)
+        return g, "BerkeleyDB"
+    pickle_warning()
+    return create_local_graph(), "pickle"
+
+def graph_cache_commit(cache_dir, g, store, source, options):
+    if store == "BerkeleyDB":
+        g.store.sync()
+    else:
+        with open(os.path.join(cache_dir, "graph.pickle.tmp"), "wb") as outfile:
+            pickle.dump(g, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(os.path.join(cache_dir, "graph.pickle.tmp"), os.path.join(cache_dir, "graph.pickle"))
+
+    # meta.json is written last and marks the entry as complete
+    with open(os.path.join(cache_dir, "meta.json.tmp"), "wt") as outfile:
+        json.dump({"source": source, "options": options, "store": store, "identifier": str(g.identifier), "triples": len(g),
+                   "created": time.time()}, outfile)
+    os.replace(os.path.join(cache_dir, "meta.json.tmp"), os.path.join(cache_dir, "meta.json"))
+
+class LabelBNodes(dict):
+    """bnode context that maps a blank node label to the same BNode in every chunk of a file"""
+    def __init__(self, bnode_prefix):
+        super().__init__()
+        self.bnode_prefix = bnode_prefix
+
+    def get(self, bnode_id, default=None):
+        return self.bnode_prefix + bnode_id
+
+def line_chunks(filename, chunk_count):
+    """byte ranges of roughly equal size that start and end at line boundaries"""
+    file_size = os.path.getsize(filename)
+    chunk_size = max(min(file_size // chunk_count, PARALLEL_LOAD_MAX_CHUNK), 1)
+    boundaries = [0]
+    with open(filename, "rb") as infile:
+        while boundaries[-1] + chunk_size < file_size:
+            infile.seek(boundaries[-1] + chunk_size)
+            infile.readline()
+            if infile.tell() >= file_size:
+                break
+            boundaries.append(infile.tell())
+    boundaries.append(file_size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+class ChunkSink:
+    """parser sink that collects the triples of a chunk as positions in a table of encoded terms,
+    a worker sends back each distinct term of its chunk once and a flat array of positions"""
+    # graph of N-Quads lines without one, the N-Quads parser reads it from the sink
+    identifier = None
 
-def load_local(args):
-    filename = args.endpoint
-    fprint("file", os.path.basename(filename))
-    prompt = os.path.basename(filename)[:20] + "> "
+    def __init__(self):
+        import sparqlcli_store
+        self.encode_term = sparqlcli_store.encode_term
+        self.term_ids = {}
+        self.terms = []
+        # three positions per triple, four with the graph for N-Quads
+        self.ids = array.array("I")
+        self.context = None
+
+    def term_id(self, term):
+        key = self.encode_term(term)
+        term_id = self.term_ids.get(key)
+        if term_id is None:
+            term_id = self.term_ids[key] = len(self.terms)
+            self.terms.append(key)
+        return term_id
+
+    def triple(self, subject, predicate, obj):
+        self.ids.extend((self.term_id(subject), self.term_id(predicate), self.term_id(obj)))
+
+    def get_context(self, context):
+        self.context = context
+        return self
+
+    def add(self, triple):
+        self.triple(*triple)
+        self.ids.append(self.term_id(self.context))
+
+def parse_chunk(filename, file_format, start, end, bnode_prefix):
+    from rdflib.plugins.parsers.ntriples import W3CNTriplesParser, ParseError
+    from rdflib.plugins.parsers.nquads import NQuadsParser
+    with open(filename, "rb") as infile:
+        infile.seek(start)
+        data = infile.read(end - start).decode("utf-8")
+
+    sink = ChunkSink()
+    parser = NQuadsParser() if file_format == "nquads" else W3CNTriplesParser()
+    parser.sink = sink
+    bnode_context = LabelBNodes(bnode_prefix)
+    for line in data.split("\n"):
+        parser.line = line.rstrip("\r")
+        try:
+            parser.parseline(bnode_context)
+        except ParseError as msg:
+            raise ParseError(f"Invalid line ({msg}):\n{line!r}")
+    return sink.terms, sink.ids
+
+def parse_local_parallel(g, filename, file_format):
+    import rdflib
+    import concurrent.futures
+    import multiprocessing
+    import uuid
+    import sparqlcli_store
+
+    chunks = line_chunks(filename, args.load_workers * 4)
+    # blank node labels are only unique within a file, the prefix keeps them apart from other loads
+    bnode_prefix = "b" + uuid.uuid4().hex[:8]
+    if file_format == "nquads":
+        merge_graph = rdflib.ConjunctiveGraph(store=g.store)
+
+    mp_context = None
+    if "fork" in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context("fork")
+
+    load_start = time.time()
+    progress_time = load_start
+    bytes_done = 0
+    triple_count = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.load_workers, mp_context=mp_context) as executor:
+        futures = {executor.submit(parse_chunk, filename, file_format, start, end, bnode_prefix): end - start \
+                   for start, end in chunks}
+        for chunk_idx, future in enumerate(concurrent.futures.as_completed(futures)):
+            keys, ids = future.result()
+            if hasattr(g.store, "add_encoded"):
+                # the compact store appends the ids in bulk, only the distinct terms are interned here
+                g.store.add_encoded(keys, ids)
+                triple_count += len(ids) // 3
+            else:
+                # the memory store indexes every triple itself, this part stays in the loading process
+                terms = [sparqlcli_store.decode_term(key) for key in keys]
+                if file_format == "nquads":
+                    merge_graph.addN((terms[ids[idx]], terms[ids[idx + 1]], terms[ids[idx + 2]],
+                                      merge_graph.get_context(terms[ids[idx + 3]] or g.identifier)) \
+                                     for idx in range(0, len(ids), 4))
+                    triple_count += len(ids) // 4
+                else:
+                    g.store.addN((terms[ids[idx]], terms[ids[idx + 1]], terms[ids[idx + 2]], g) \
+                                 for idx in range(0, len(ids), 3))
+                    triple_count += len(ids) // 3
+
+            bytes_done += futures[future]
+            if time.time() - progress_time >= 1 or chunk_idx + 1 == len(chunks):
+                progress_time = time.time()
+                throughput = bytes_done / max(progress_time - load_start, 0.001) / 1024 / 1024
+                fprint("parsing", f"{chunk_idx + 1}/{len(chunks)} chunks, {triple_count} triples, {throughput:.1f} MiB/s")
+
+def loaded_triples(g):
+    """triples in the graph, the compact store counts added triples without building its indexes"""
+    if hasattr(g.store, "added_count"):
+        return g.store.added_count()
+    return len(g)
+
+def parse_local_file(g, filename):
+    import rdflib.util
+    file_format = args.format
+    if file_format is None:
+        file_format = rdflib.util.guess_format(inner_filename(filename))
+    compressed = inner_filename(filename) != filename
+
+    if args.store == "compact" and file_format in QUAD_FORMATS:
+        raise Exception(f"the compact store holds a single graph and cannot load {file_format}, use --store memory")
+
+    file_size = os.path.getsize(filename)
+    triples_before = loaded_triples(g)
+    load_start = time.time()
+    if not compressed and file_format in LINE_FORMATS and args.load_workers > 1 and \
+            file_size >= PARALLEL_LOAD_MIN_SIZE:
+        fprint("parsing", f"{file_format} in parallel, {args.load_workers} workers")
+        if args.store == "memory":
+            vprint("parsing", "the memory store inserts every triple in this process, --store compact adds them in bulk")
+        parse_local_parallel(g, filename, file_format)
+    elif compressed:
+        if file_format is None:
+            raise Exception(f"cannot detect the format of {filename}, use --format")
+        # decompressed while the parser reads, nothing is inflated on disk
+        with open_local(filename) as infile:
+            g.parse(source=infile, format=file_format)
+    elif args.format is None:
+        g.parse(filename)
+    else:
+        g.parse(filename, format=args.format)
 
-    g = rdflib.Graph()
-    add_namespace_params(g)
+    duration = max(time.time() - load_start, 0.001)
+    fprint("parsing", f"{os.path.basename(filename)}: {loaded_triples(g) - triples_before} triples, " + \
+           f"{file_size / 1024 / 1024:.1f} MiB in {duration:.2f}s ({file_size / 1024 / 1024 / duration:.1f} MiB/s)")
 
+def parse_local(g, filenames):
     fprint("parsing", "format=" + ("auto-detect" if args.format is None else args.format))
 
+    load_start = time.time()
     try:
-        if args.format is None:
-            g.parse(filename)
-        else:
-            g.parse(filename, format=args.format)
+        for filename in filenames:
+            parse_local_file(g, filename)
     except Exception as err:
         fprint("error", f"{err}")
         sys.exit(1)
 
-    fprint("parsing", "complete")
+    fprint("parsing", f"complete, {len(g)} triples in {time.time() - load_start:.2f}s")
+    report_store(g)
+
+def create_local_graph():
+    import rdflib
+    if args.store == "compact":
+        import sparqlcli_store
+        return rdflib.Graph(store=sparqlcli_store.CompactStore())
+    return rdflib.Graph()
+
+def peak_memory():
+    """peak resident memory of this process in bytes, None where it cannot be determined"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+def report_store(g):
+    peak_rss = peak_memory()
+    peak_info = "" if peak_rss is None else f", peak resident memory {peak_rss / 1024 / 1024:.1f} MiB"
+    if not hasattr(g.store, "footprint"):
+        fprint("store", f"{args.store}{peak_info}")
+        return
+    footprint = g.store.footprint()
+    fprint("store", f"{args.store}, {footprint['terms']} terms, " + \
+           f"indexes {footprint['index_bytes'] / 1024 / 1024:.1f} MiB, " + \
+           f"term dictionary {footprint['term_bytes'] / 1024 / 1024:.1f} MiB{peak_info}")
+
+def load_local(args):
+    if len(args.files) == 1:
+        fprint("file", os.path.basename(args.files[0]))
+        prompt = os.path.basename(args.files[0])[:20] + "> "
+    else:
+        fprint("files", len(args.files))
+        prompt = f"{len(args.files)} files> "
+
+    if not args.graph_cache:
+        g = create_local_graph()
+        add_namespace_params(g)
+        parse_local(g, args.files)
+        return g, g, prompt
+
+    cache_root = os.path.join(os.path.expanduser(args.cache_dir), "graphs")
+    source, cache_key = graph_cache_key(args)
+    cache_dir = os.path.join(cache_root, cache_key)
+
+    load_start = time.time()
+    try:
+        g = graph_cache_open(cache_dir)
+    except Exception as err:
+        vprint("\[graph cache]", f"cannot open {cache_dir}: {err}")
+        g = None
+
+    if g is not None:
+        fprint("\[graph cache]", f"hit, {len(g)} triples in {time.time() - load_start:.2f}s")
+    else:
+        fprint("\[graph cache]", "miss, rebuilding")
+        graph_cache_evict(cache_root, source, graph_cache_options(args), max(args.graph_cache_keep - 1, 0))
+        # an incomplete or unreadable entry is not reused
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        g, store = graph_cache_create(cache_dir)
+        parse_local(g, args.files)
+        graph_cache_commit(cache_dir, g, store, source, graph_cache_options(args))
+        vprint("\[graph cache]", f"stored as {store} in {cache_dir}")
+
+    add_namespace_params(g)
     return g, g, prompt
 
-def init_remote(args):
+def scan_index_filename(filename):
+    cache_key = hashlib.sha1(os.path.abspath(filename).encode("utf-8")).hexdigest()
+    return os.path.join(os.path.expanduser(args.cache_dir), "scan", cache_key + ".idx")
+
+def init_scan(args):
+    import rdflib
+    import rdflib.util
+    import sparqlcli_scan
+    # holds the namespaces, the files are only loaded into a graph for queries the index cannot answer
     g = rdflib.Graph()
     add_namespace_params(g)
 
-    sparql_remote = sparqlw.SPARQLWrapper("http://dbpedia.org/sparql")
-    sparql_remote.setReturnFormat(sparqlw.JSON)
+    scan_files = []
+    for filename in args.files:
+        file_format = args.format or rdflib.util.guess_format(inner_filename(filename))
+        if inner_filename(filename) != filename or file_format not in LINE_FORMATS:
+            fprint("error", f"--scan needs uncompressed nt or nquads files: {filename}")
+            sys.exit(1)
+
+        def progress(bytes_done, file_size):
+            fprint("scan", f"indexing {os.path.basename(filename)}, {bytes_done / max(file_size, 1):.0%}")
+
+        index_start = time.time()
+        index_filename = scan_index_filename(filename)
+        scan_file = sparqlcli_scan.ScanFile(filename, index_filename, progress)
+        index_info = f"built in {time.time() - index_start:.2f}s" if scan_file.built else "reused"
+        fprint("scan", f"{os.path.basename(filename)}: index {os.path.getsize(index_filename) / 1024 / 1024:.1f} MiB, {index_info}")
+        scan_files.append(scan_file)
+
+    if len(args.files) == 1:
+        prompt = os.path.basename(args.files[0])[:20] + "> "
+    else:
+        prompt = f"{len(args.files)} files> "
+    return ScanEndpoint(scan_files), g, prompt
+
+class ScanEndpoint:
+    """local files queried through the block index of sparqlcli_scan where the query allows it,
+    other queries run on the graph of the files, which is loaded when the first one needs it"""
+    def __init__(self, scan_files):
+        self.scan_files = scan_files
+        self.graph = None
+        self.lock = threading.Lock()
+
+    def select(self, prepared):
+        """result variables and rows of a prepared query, None if the index cannot answer it"""
+        import sparqlcli_scan
+        plan = sparqlcli_scan.select_plan(prepared.algebra)
+        if plan is None:
+            return None
+        vprint("\[scan]", f"{len(plan[1])} triple patterns from the index")
+        return plan[0], sparqlcli_scan.ScanQuery(self.scan_files).rows(plan)
+
+    def full_graph(self):
+        with self.lock:
+            if self.graph is None:
+                fprint("scan", "the query needs the full query engine, loading the files")
+                self.graph, _, _ = load_local(args)
+            return self.graph
+
+def create_remote(args, endpoint=None):
+    import SPARQLWrapper as sparqlw
+    sparql_remote = sparqlw.SPARQLWrapper(endpoint or args.endpoint)
+    sparql_remote.setReturnFormat(sparqlw.XML if args.remote_format == "xml" else sparqlw.JSON)
     # sparql_remote.setMethod(sparqlw.POST)
+    return sparql_remote
+
+http_session = None
+
+def remote_session():
+    global http_session
+    if http_session is None:
+        import requests
+        import requests.adapters
+        import urllib3.util.retry
+        retry = urllib3.util.retry.Retry(total=args.http_retries,
+                                         backoff_factor=args.http_backoff,
+                                         status_forcelist=[429, 502, 503, 504],
+                                         allowed_methods=False,
+                                         raise_on_status=False)
+        pool_size = max(args.page_workers, args.batch_workers, 1)
+        http_adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size, max_retries=retry)
+        http_session = requests.Session()
+        http_session.mount("http://", http_adapter)
+        http_session.mount("https://", http_adapter)
+    return http_session
+
+def remote_query(sparql_remote, accept=None):
+    """sends the query of a SPARQLWrapper instance over the pooled session, returns the
+    decompressed response body as a file-like object"""
+    import SPARQLWrapper.SPARQLExceptions as sparqlw_exceptions
+    http_errors = {400: sparqlw_exceptions.QueryBadFormed,
+                   401: sparqlw_exceptions.Unauthorized,
+                   404: sparqlw_exceptions.EndPointNotFound,
+                   414: sparqlw_exceptions.URITooLong,
+                   500: sparqlw_exceptions.EndPointInternalError}
+
+    request = sparql_remote._createRequest()
+    headers = dict(request.header_items())
+    headers["Accept-Encoding"] = "gzip, deflate"
+    if accept is not None:
+        headers["Accept"] = accept
+    worker = getattr(query_workers, "query", None)
+    timeout = args.http_timeout
+    if worker is not None and worker.deadline is not None:
+        remaining = max(worker.deadline - time.time(), 0) + QUERY_DEADLINE_SLACK
+        timeout = remaining if timeout is None else min(timeout, remaining)
+    response = remote_session().request(request.get_method(), request.full_url,
+                                        headers=headers,
+                                        data=request.data,
+                                        timeout=timeout,
+                                        stream=True)
+    if worker is not None:
+        worker.add_response(response)
+        # a registered response is closed on cancel, reading the rest is only limited by --http-timeout
+        sock = getattr(getattr(response.raw, "_connection", None), "sock", None)
+        if sock is not None:
+            sock.settimeout(args.http_timeout)
+    if response.status_code in http_errors:
+        raise http_errors[response.status_code](response.content)
+    response.raise_for_status()
+    response.raw.decode_content = True
+    return response.raw
+
+def close_response(response):
+    # shutting the socket down wakes up a read blocked in another thread, closing it would not
+    connection = getattr(response.raw, "_connection", None)
+    sock = getattr(connection, "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
+
+class ResultCache:
+    """LRU cache of remote response bodies with a TTL and a byte budget, optionally mirrored to disk"""
+    def __init__(self, ttl, max_bytes, cache_dir=None):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.prune_disk()
+
+    def key(self, query):
+        # whitespace inside literals, IRIs and comments is kept, it can change the result
+        key_data = json.dumps([args.endpoint, args.remote_format, normalize_query(query).strip()])
+        return hashlib.sha1(key_data.encode("utf-8")).hexdigest()
+
+    def entry_filename(self, key):
+        return os.path.join(self.cache_dir, key + ".body")
+
+    def prune_disk(self):
+        disk_entries = []
+        for entry in os.listdir(self.cache_dir):
+            entry_filename = os.path.join(self.cache_dir, entry)
+            entry_stat = os.stat(entry_filename)
+            disk_entries.append((entry_stat.st_mtime, entry_stat.st_size, entry_filename))
+
+        disk_size = 0
+        for created, entry_size, entry_filename in sorted(disk_entries, reverse=True):
+            disk_size += entry_size
+            if disk_size > self.max_bytes or time.time() - created > self.ttl:
+                os.unlink(entry_filename)
+
+    def load(self, key):
+        entry_filename = self.entry_filename(key)
+        if not os.path.exists(entry_filename):
+            return None
+        with open(entry_filename, "rb") as infile:
+            body = infile.read()
+        self.store(key, os.path.getmtime(entry_filename), body)
+        return self.entries[key]
+
+    def store(self, key, created, body):
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key)[1])
+        self.entries[key] = (created, body)
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            evicted_key, (_, evicted_body) = self.entries.popitem(last=False)
+            self.size -= len(evicted_body)
+            if self.cache_dir is not None and os.path.exists(self.entry_filename(evicted_key)):
+                os.unlink(self.entry_filename(evicted_key))
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None and self.cache_dir is not None:
+                entry = self.load(key)
+            if entry is not None and time.time() - entry[0] > self.ttl:
+                self.remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            self.store(key, time.time(), body)
+            if self.cache_dir is not None:
+                with open(self.entry_filename(key) + ".tmp", "wb") as outfile:
+                    outfile.write(body)
+                os.replace(self.entry_filename(key) + ".tmp", self.entry_filename(key))
+
+    def remove(self, key):
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key)[1])
+        if self.cache_dir is not None and os.path.exists(self.entry_filename(key)):
+            os.unlink(self.entry_filename(key))
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.entries.keys()):
+                self.remove(key)
+            if self.cache_dir is not None:
+                for entry in os.listdir(self.cache_dir):
+                    os.unlink(os.path.join(self.cache_dir, entry))
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return f"{len(self.entries)} entries, {self.size / 1024:.1f} of {self.max_bytes / 1024:.1f} KiB, " + \
+               f"{self.hits} hits, {self.misses} misses, ttl {self.ttl:g}s" + \
+               ("" if self.cache_dir is None else f", stored in {self.cache_dir}")
+
+class CachingResponse:
+    """file-like wrapper that stores the response body in the result cache once it is read completely"""
+    def __init__(self, response, cache, key):
+        self.response = response
+        self.cache = cache
+        self.key = key
+        self.chunks = []
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.response.read(size)
+        if self.chunks is None:
+            return data
+        if data:
+            self.chunks.append(data)
+            self.size += len(data)
+            if self.size > self.cache.max_bytes:
+                self.chunks = None
+        else:
+            self.cache.put(self.key, b"".join(self.chunks))
+            self.chunks = None
+        return data
+
+result_cache = None
+
+def remote_response(sparql_remote, query):
+    """response body for a query, served from the result cache if possible"""
+    if result_cache is None or NOCACHE_HINT.search(query) is not None:
+        return remote_query(sparql_remote)
+
+    cache_key = result_cache.key(query)
+    body = result_cache.get(cache_key)
+    if body is not None:
+        vprint("\[result cache]", f"hit, {len(body)} bytes")
+        return io.BytesIO(body)
+    return CachingResponse(remote_query(sparql_remote), result_cache, cache_key)
+
+def remote_connection_stats():
+    connection_pool = remote_session().get_adapter(args.endpoint).poolmanager.connection_from_url(args.endpoint)
+    return f"{connection_pool.num_requests} requests over {connection_pool.num_connections} connections"
+
+def init_remote(args):
+    import rdflib
+    g = rdflib.Graph()
+    add_namespace_params(g)
+
+    sparql_remote = create_remote(args)
+
+    global result_cache
+    if args.result_cache_ttl > 0:
+        result_cache_dir = None
+        if args.result_cache_disk:
+            result_cache_dir = os.path.join(os.path.expanduser(args.cache_dir), "results")
+        result_cache = ResultCache(args.result_cache_ttl, int(args.result_cache_size * 1024 * 1024), result_cache_dir)
 
     prompt = urlparse(args.endpoint).netloc + "> "
 
     return sparql_remote, g, prompt
 
-if args.remote is None or args.remote == False:
-    query_endpoint, g, prompt = load_local(args)
-else:
-    query_endpoint, g, prompt = init_remote(args)
+def source_names(sources):
+    """short names of federated sources, the full endpoint where a short name is ambiguous"""
+    names = [urlparse(endpoint).netloc if remote else os.path.basename(endpoint.rstrip(os.sep)) \
+             for endpoint, remote in sources]
+    return [name if names.count(name) == 1 else endpoint for name, (endpoint, remote) in zip(names, sources)]
+
+def init_federation(args):
+    import rdflib
+    # holds the namespaces of all sources, like the graph of a remote endpoint
+    g = rdflib.Graph()
+    add_namespace_params(g)
+
+    sources = []
+    for name, (endpoint, remote) in zip(source_names(args.sources), args.sources):
+        if remote:
+            sources.append((name, endpoint))
+            continue
+        source_args = argparse.Namespace(**vars(args))
+        source_args.files = expand_local_paths([endpoint])
+        source_graph, _, _ = load_local(source_args)
+        sources.append((name, source_graph))
+    fprint("sources", ", ".join([name for name, _ in sources]))
+
+    return Federation(sources), g, f"{len(sources)} sources> "
+
+class Federation:
+    """several endpoints queried as one: a SELECT query is sent to all of them at once and
+    their rows are merged in the order they arrive, with the source name in the first column
+
+    Every source runs in its own thread and hands its rows over in batches through a bounded
+    queue, so a fast source is not held up by a slow one and a slow consumer holds back the
+    sources instead of buffering their results."""
+    def __init__(self, sources):
+        self.sources = sources
+
+    def source_rows(self, endpoint, query, full_sparql):
+        """result variables and rows of one source"""
+        if isinstance(endpoint, str):
+            sparql_remote = create_remote(args, endpoint)
+            sparql_remote.setQuery(full_sparql)
+            # results of different endpoints would share one key in the result cache
+            columns, bindings = read_remote_result(remote_result_events(remote_query(sparql_remote)))
+            return columns, ([sparqlw_to_string(g, row.get(column)) for column in columns] for row in bindings)
+
+        import rdflib
+        import rdflib.plugins.sparql
+
+        def term_string(val):
+            # the strings sparqlw_to_string gives for remote values, so equal rows of any source compare equal
+            if val is None:
+                return ""
+            if isinstance(val, rdflib.URIRef):
+                return get_prefix_index(g).compact(str(val))
+            if isinstance(val, rdflib.BNode):
+                return "_:" + str(val)
+            return str(val)
+
+        namespaces = dict(g.namespaces())
+        if prepared_queries is not None:
+            prepared = prepared_queries.prepare(query, namespaces)
+        else:
+            prepared = rdflib.plugins.sparql.prepareQuery(query, initNs=namespaces)
+        qres = endpoint.query(prepared)
+        columns = [str(var) for var in qres.vars]
+        return columns, ([term_string(val) for val in row] for row in qres)
+
+    def run_source(self, name, endpoint, query, full_sparql, events, stop, worker):
+        query_workers.query = worker
+        source_start = time.time()
+        stats = {"rows": 0, "first_row": None, "error": None}
+        try:
+            columns, rows = self.source_rows(endpoint, query, full_sparql)
+            events.put(("head", name, columns))
+            batch = []
+            for row in rows:
+                if stop.is_set():
+                    break
+                if stats["first_row"] is None:
+                    stats["first_row"] = time.time() - source_start
+                stats["rows"] += 1
+                batch.append(row)
+                if len(batch) >= FEDERATION_BATCH_SIZE or events.empty():
+                    events.put(("rows", name, batch))
+                    batch = []
+            if len(batch) > 0:
+                events.put(("rows", name, batch))
+        except Exception as ex:
+            stats["error"] = ex
+        finally:
+            query_workers.query = None
+            stats["seconds"] = time.time() - source_start
+            events.put(("done", name, stats))
+
+    def execute(self, query, out=None):
+        import queue
+        if query_form(query) != "SELECT":
+            raise Exception("queries over several endpoints have to be SELECT queries")
+        sparql_prefixes = "\n".join([f"PREFIX {ns}: <{nslong}>" for ns, nslong in g.namespace_manager.namespaces()])
+        full_sparql = sparql_prefixes + "\n" + query
+
+        events = queue.Queue(maxsize=FEDERATION_QUEUE_SIZE)
+        stop = threading.Event()
+        worker = getattr(query_workers, "query", None)
+        for name, endpoint in self.sources:
+            threading.Thread(target=self.run_source, args=(name, endpoint, query, full_sparql, events, stop, worker),
+                             name=f"source {name}", daemon=True).start()
+
+        def next_event():
+            # waits in short slices, a cancelled query worker is not interrupted inside a blocking get
+            while True:
+                try:
+                    return events.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+        # the columns of the first source that answers, the rows of the others are matched by name
+        source_stats = {}
+        source_columns = {}
+        pending_events = collections.deque()
+        columns = None
+        while columns is None and len(source_stats) < len(self.sources):
+            event = next_event()
+            if event[0] == "head":
+                columns = event[2]
+                source_columns[event[1]] = event[2]
+            elif event[0] == "done":
+                source_stats[event[1]] = event[2]
+            else:
+                pending_events.append(event)
+        if columns is None:
+            for name, stats in source_stats.items():
+                fprint("\[error]", f"{name}: {stats['error']}")
+            raise Exception("no source answered the query")
+
+        def rows():
+            seen = set()
+            try:
+                while len(pending_events) > 0 or len(source_stats) < len(self.sources):
+                    kind, name, value = pending_events.popleft() if len(pending_events) > 0 else next_event()
+                    if kind == "head":
+                        source_columns[name] = value
+                        if set(value) != set(columns):
+                            vprint("\[federation]", f"{name} returned the variables {', '.join(value)}")
+                    elif kind == "done":
+                        source_stats[name] = value
+                    else:
+                        positions = [source_columns[name].index(column) if column in source_columns[name] else None \
+                                     for column in columns]
+                        for row in value:
+                            row = [row[position] if position is not None else None for position in positions]
+                            if args.dedup:
+                                row_key = tuple(row)
+                                if row_key in seen:
+                                    continue
+                                seen.add(row_key)
+                            yield [name] + row
+            finally:
+                stop.set()
+
+        completer_options = output_rows(["source"] + columns, rows(), query, out)
+        for name, _ in self.sources:
+            stats = source_stats.get(name)
+            if stats is None:
+                fprint("\[source]", f"{name}: stopped")
+            elif stats["error"] is not None:
+                fprint("\[error]", f"{name}: {stats['error']}")
+            else:
+                first_row = f", first row {stats['first_row']:.3f}s" if stats["first_row"] is not None else ""
+                fprint("\[source]", f"{name}: {stats['rows']} rows{first_row}, {stats['seconds']:.3f}s")
+        return completer_options
+
+query_endpoint = None
+g = None
+
+def normalize_query(query):
+    """collapse whitespace outside of literals, IRIs and comments, line breaks are kept since they end comments"""
+    return QUERY_TOKEN.sub(lambda match: match.group(1) or ("\n" if "\n" in match.group(0) else " "), query)
+
+class PreparedQueryCache:
+    """LRU cache of parsed and translated local queries, keyed by query text and namespace bindings"""
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def prepare(self, query, namespaces):
+        import rdflib.plugins.sparql
+        key = (normalize_query(query), tuple(sorted(namespaces.items())))
+        with self.lock:
+            prepared = self.entries.get(key)
+            if prepared is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                vprint("\[query cache]", "hit")
+                return prepared
+            self.misses += 1
+
+        # parse errors propagate like those of an unprepared query and are not cached
+        prepared = rdflib.plugins.sparql.prepareQuery(query, initNs=namespaces)
+        with self.lock:
+            self.entries[key] = prepared
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return prepared
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return f"{len(self.entries)} of {self.max_entries} queries, {self.hits} hits, {self.misses} misses"
+
+prepared_queries = None
+
+def init_endpoint():
+    global query_endpoint, g, prompt, prepared_queries
+    if args.federated:
+        query_endpoint, g, prompt = init_federation(args)
+        if args.query_cache_size > 0:
+            prepared_queries = PreparedQueryCache(args.query_cache_size)
+    elif args.scan:
+        query_endpoint, g, prompt = init_scan(args)
+        if args.query_cache_size > 0:
+            prepared_queries = PreparedQueryCache(args.query_cache_size)
+    elif args.remote is None or args.remote == False:
+        query_endpoint, g, prompt = load_local(args)
+        if args.query_cache_size > 0:
+            prepared_queries = PreparedQueryCache(args.query_cache_size)
+    else:
+        query_endpoint, g, prompt = init_remote(args)
+
+class PrefixIndex:
+    """longest-match lookup of namespace prefixes for IRIs, compacted IRIs are memoized"""
+    def __init__(self, g, memo_size=100000):
+        self.graph = g
+        self.prefixes = {}
+        for ns, nslong in g.namespace_manager.namespaces():
+            self.prefixes.setdefault(str(nslong), ns)
+        self.lengths = sorted(set([len(nslong) for nslong in self.prefixes]), reverse=True)
+        self.memo_size = memo_size
+        self.memo = {}
+        self.n3_memo = {}
+
+    def split(self, iri):
+        for length in self.lengths:
+            if length > len(iri):
+                continue
+            prefix = self.prefixes.get(iri[:length])
+            if prefix is not None:
+                return prefix, iri[length:]
+        return None, iri
+
+    def remember(self, memo, iri, compacted):
+        if len(memo) >= self.memo_size:
+            memo.clear()
+        memo[iri] = compacted
+        return compacted
+
+    def compact(self, iri):
+        compacted = self.memo.get(iri)
+        if compacted is None:
+            prefix, local = self.split(iri)
+            compacted = self.remember(self.memo, iri, iri if prefix is None else f"{prefix}:{local}")
+        return compacted
+
+    def n3(self, iri):
+        """like compact, but IRIs are only shortened to valid prefixed names and enclosed in <> otherwise"""
+        compacted = self.n3_memo.get(iri)
+        if compacted is None:
+            prefix, local = self.split(iri)
+            if prefix is None or QNAME_LOCAL.match(local) is None:
+                compacted = self.remember(self.n3_memo, iri, f"<{iri}>")
+            else:
+                compacted = self.remember(self.n3_memo, iri, f"{prefix}:{local}")
+        return compacted
+
+prefix_index = None
+# bumped whenever namespace bindings change, the completer re-reads the prefixes on change
+namespace_version = 0
+
+def invalidate_prefix_index():
+    global prefix_index, namespace_version
+    prefix_index = None
+    namespace_version += 1
+
+def get_prefix_index(g):
+    global prefix_index
+    if prefix_index is None or prefix_index.graph is not g:
+        prefix_index = PrefixIndex(g)
+    return prefix_index
 
 def sparqlw_to_string(g, val):
     if val is None:
@@ -179,145 +1378,994 @@ def sparqlw_to_string(g, val):
     if type(val) is str:
         return val
     if val.get("type", "") == "uri":
-        res_uri = val.get("value", "")
-        for ns, nslong in g.namespace_manager.namespaces():
-            if res_uri.startswith(nslong):
-                res_uri = ns + ":" + res_uri[len(nslong):]
-        return res_uri
+        return get_prefix_index(g).compact(val.get("value", ""))
     elif val.get("type", "") in ["literal", "typed-literal"]:
-        lit_val = val.get("value", "")
-        lit_val = rdflib.term.Literal(lit_val)
-        return str(lit_val.toPython())
+        # the datatype is not used, the string value is what Literal(value).toPython() returns
+        return val.get("value", "")
+    elif val.get("type", "") == "bnode":
+        return "_:" + val.get("value", "")
     else:
         raise Exception(f"cannot decode value type {val.get('type', '')} in {str(val)}")
 
 def rdflib_to_string(g, val):
+    import rdflib
     if val is None:
         return ""
     if type(val) is rdflib.term.Literal:
         return str(val.toPython())
+    if type(val) is rdflib.term.URIRef:
+        return get_prefix_index(g).n3(val)
     return val.n3(g.namespace_manager)
 
-# {'head': {'link': [], 'vars': ['a', 'b']}, 'results': {'distinct': False, 'ordered': True, 'bindings': [{'a': {'type': 'uri', 'value': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type'}, 'b': {'type': 'uri', 'value': 'http://www.openlinksw.com/schemas/virtcxml#FacetCategoryPattern'}}, {'a': {'type': 'uri', 'value': 'http://www.w3.org/2001/XMLSchema#anyURI'}, 'b': {'type': 'uri', 'value': 'http://www.w3.org/2000/01/rdf-schema#Datatype'}}, {'a': {'type': 'uri', 'value': 'http://www.w3.org/2001/XMLSchema#anyURI'}, 'b': {'type': 'uri', 'value': 'http://www.w3.org/2000/01/rdf-schema#Datatype'}}, {'a': {'type': 'uri', 'value': 'http://www.w3.org/2001/XMLSchema#boolean'}, 'b': {'type': 'uri', 'value': 'http://www.w3.org/2000/01/rdf-schema#Datatype'}}, {'a': {'type': 'uri', 'value': 'http://www.w3.org/2001/XMLSchema#boolean'}, 'b': {'type': 'uri', 'value': 'http://www.w3.org/2000/01/rdf-schema#Datatype'}}, {'a': {'type': 'uri', 'value': 'http://www.w3.org/2001/XMLSchema#date'}, 'b': {'type': 'uri', 'value': 'http://www.w3.org/2000/01/rdf-schema#Datatype'}}, {'a': {'type': 'uri', 'value': 'http://www.w3.org/2001/XMLSchema#date'}, 'b': {'type': 'uri', 'value': 'http://www.w3.org/2000/01/rdf-schema#Datatype'}}, {'a': {'type': 'uri', 'value': 'http://www.w3.org/2001/XMLSchema#dateTime'}, 'b': {'type': 'uri', 'value': 'http://www.w3.org/2000/01/rdf-schema#Datatype'}}, {'a': {'type': 'uri', 'value': 'http://www.w3.org/2001/XMLSchema#dateTime'}, 'b': {'type': 'uri', 'value': 'http://www.w3.org/2000/01/rdf-schema#Datatype'}}, {'a': {'type': 'uri', 'value': 'http://www.w3.org/2001/XMLSchema#double'}, 'b': {'type': 'uri', 'value': 'http://www.w3.org/2000/01/rdf-schema#Datatype'}}]}}
-def output_remote_result(g, qres, query):
-    qres_count = len(qres.get("results", {}).get("bindings", []))
-    completer_options = set()
+class QueryTimer:
+    """wall time per query phase, a nested phase pauses the phase it was entered from"""
+    def __init__(self):
+        self.phases = collections.OrderedDict()
+        self.stack = []
+        self.started = time.perf_counter()
+        self.mark = self.started
+        self.rows = None
+
+    def enter(self, name):
+        now = time.perf_counter()
+        if len(self.stack) > 0:
+            self.phases[self.stack[-1]] = self.phases.get(self.stack[-1], 0.0) + now - self.mark
+        self.stack.append(name)
+        self.mark = now
+
+    def leave(self):
+        now = time.perf_counter()
+        name = self.stack.pop()
+        self.phases[name] = self.phases.get(name, 0.0) + now - self.mark
+        self.mark = now
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def summary(self):
+        total = self.total()
+        phases = list(self.phases.items()) + [("other", max(total - sum(self.phases.values()), 0.0))]
+        return f"total {total * 1000:.1f} ms: " + \
+            ", ".join([f"{name} {seconds * 1000:.1f} ms" for name, seconds in phases])
+
+# timers are per thread, batch queries run concurrently and page fetches run in worker threads
+query_timers = threading.local()
+
+def timed_phase(name):
+    timer = getattr(query_timers, "timer", None)
+    if timer is None:
+        return contextlib.nullcontext()
+
+    @contextlib.contextmanager
+    def phase():
+        timer.enter(name)
+        try:
+            yield
+        finally:
+            timer.leave()
+    return phase()
+
+def timed_rows(name, rows):
+    """times every step of a lazily produced iterable as a phase"""
+    timer = getattr(query_timers, "timer", None)
+    if timer is None:
+        return rows
+
+    def timed():
+        row_iter = iter(rows)
+        while True:
+            timer.enter(name)
+            try:
+                row = next(row_iter)
+            except StopIteration:
+                return
+            finally:
+                timer.leave()
+            yield row
+    return timed()
+
+class TimedResponse:
+    """file-like wrapper around a remote response that reports the time to the first body byte"""
+    def __init__(self, response, query_start):
+        self.response = response
+        self.query_start = query_start
+        self.first_byte = None
+
+    def read(self, size=-1):
+        with timed_phase("network"):
+            data = self.response.read(size)
+        if self.first_byte is None and data:
+            self.first_byte = time.time()
+            vprint("\[first byte]", f"{self.first_byte - self.query_start:.3f}s")
+        return data
+
+class SparqlJSONStream:
+    """incremental reader for SPARQL JSON results, yields (key, value) events for top-level
+    members and one ("binding", value) event per result row while the response is read"""
+    def __init__(self, stream, chunk_size=65536):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        self.eof = not chunk
+        self.buffer = self.buffer[self.pos:] + self.text_decoder.decode(chunk, final=self.eof)
+        self.pos = 0
+        return not self.eof
+
+    def peek(self):
+        while True:
+            self.pos = json.decoder.WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, chars):
+        char = self.peek()
+        if char is None or char not in chars:
+            raise ValueError(f"invalid SPARQL JSON result: expected {chars!r}, found {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                val, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # a number at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and self.fill():
+                continue
+            self.pos = end
+            return val
 
-    if args.output == "json" or args.output=="csv":
-        output_data = {'query': query}
-        output_data['bindings'] = qres.get("head", {}).get("vars", [])
-        output_data['results'] = []
-        for row in qres.get("results", {}).get("bindings", []):
-            rowvals = [sparqlw_to_string(g, row[column]) for column in output_data['bindings']]
-            rowdict = {}
-            for idx, val in enumerate(rowvals):
-                rowdict[output_data['bindings'][idx]] = val
-                if val is not None and str(val) != '':
-                    completer_options.add(str(val))
-            output_data['results'].append(rowdict)
+    def members(self):
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.expect(",}") == "}":
+                return
+
+    def events(self):
+        for key in self.members():
+            if key != "results":
+                yield key, self.value()
+                continue
+            for results_key in self.members():
+                if results_key != "bindings":
+                    self.value()
+                    continue
+                self.expect("[")
+                if self.peek() == "]":
+                    self.pos += 1
+                    continue
+                while True:
+                    yield "binding", self.value()
+                    if self.expect(",]") == "]":
+                        break
 
-        if args.output == "json":
-            print(json.dumps(output_data, indent=2), file=sys.stdout)
+        # read to the end of the response so it can be cached and the connection reused
+        while self.fill():
+            pass
+
+def sparql_xml_events(stream):
+    """incremental reader for SPARQL XML results, produces the same events as SparqlJSONStream"""
+    import xml.etree.ElementTree as ElementTree
+    results_elem = None
+    for event, elem in ElementTree.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            if elem.tag == SPARQL_RESULTS_NS + "results":
+                results_elem = elem
+            continue
+
+        if elem.tag == SPARQL_RESULTS_NS + "head":
+            yield "head", {"vars": [var.get("name") for var in elem.iter(SPARQL_RESULTS_NS + "variable")]}
+        elif elem.tag == SPARQL_RESULTS_NS + "boolean":
+            yield "boolean", (elem.text or "").strip() == "true"
+        elif elem.tag == SPARQL_RESULTS_NS + "result":
+            binding = {}
+            for binding_elem in elem.iter(SPARQL_RESULTS_NS + "binding"):
+                if len(binding_elem) == 0:
+                    continue
+                term = binding_elem[0]
+                val = {"type": term.tag[len(SPARQL_RESULTS_NS):], "value": term.text or ""}
+                if term.get("datatype") is not None:
+                    val["datatype"] = term.get("datatype")
+                if term.get("{http://www.w3.org/XML/1998/namespace}lang") is not None:
+                    val["xml:lang"] = term.get("{http://www.w3.org/XML/1998/namespace}lang")
+                binding[binding_elem.get("name")] = val
+            yield "binding", binding
+            # drop processed rows so memory use does not grow with the result size
+            if results_elem is not None:
+                results_elem.remove(elem)
+
+def remote_result_events(response):
+    if args.remote_format == "xml":
+        return sparql_xml_events(response)
+    return SparqlJSONStream(response).events()
+
+def read_remote_result(events, query_start=None):
+    """returns the result variables and an iterator over the bindings that are not read yet"""
+    columns = []
+    pending_bindings = []
+    for event, val in events:
+        if event == "head":
+            columns = val.get("vars", [])
+            break
+        if event == "binding":
+            pending_bindings.append(val)
+
+    def bindings():
+        first_row = True
+        for val in itertools.chain(pending_bindings, (val for event, val in events if event == "binding")):
+            if first_row and query_start is not None:
+                vprint("\[first row]", f"{time.time() - query_start:.3f}s")
+                first_row = False
+            yield val
+
+    return columns, bindings()
+
+def strip_comments(query):
+    """the query without comments, the line breaks that end them are kept"""
+    return QUERY_TOKEN.sub(lambda match: "" if (match.group(1) or "").startswith("#") else match.group(0), query)
+
+def split_limit_offset(query):
+    """removes a trailing LIMIT/OFFSET from a query, returns the query, limit (None if unlimited) and offset"""
+    # a comment after the LIMIT would hide it and the pages would add a second one
+    query = strip_comments(query)
+    match = TRAILING_LIMIT_OFFSET.search(query)
+    if match is None:
+        return query, None, 0
+
+    limit = None
+    offset = 0
+    for modifier, value in re.findall(r"(LIMIT|OFFSET)\s+(\d+)", match.group(0), re.IGNORECASE):
+        if modifier.upper() == "LIMIT":
+            limit = int(value)
         else:
-            print("\t".join([f'"{var}"' for var in output_data['bindings']]), file=sys.stdout)
-            for row in output_data['results']:
-                print("\t".join([f'"{row[var]}"' for var in output_data['bindings']]), file=sys.stdout)
-    else:
-        table = rich.table.Table(title=f"{qres_count} result" + ("s" if qres_count > 1 else ""))
+            offset = int(value)
+    return query[:match.start()], limit, offset
 
-        qres_vars = qres.get("head", {}).get("vars", [])
-        for var in qres_vars:
-            table.add_column(var, justify="left", no_wrap=False)
+def is_pageable(query):
+    query = strip_comments(query)
+    if re.search(r"\bSELECT\b", query, re.IGNORECASE) is None:
+        vprint("\[paging]", "not a SELECT query, sending a single request")
+        return False
+    if re.search(r"\bORDER\s+BY\b", query, re.IGNORECASE) is None:
+        fprint("\[paging]", "query has no ORDER BY, pages would not be stable, sending a single request")
+        return False
+    return True
 
-        for row in qres.get("results", {}).get("bindings", []):
-            rowvals = [sparqlw_to_string(g, row[column]) for column in qres_vars]
-            for val in rowvals:
-                if val is not None and str(val) != '':
-                    completer_options.add(str(val))
-            table.add_row(*rowvals)
+def page_windows(page_size, limit, offset):
+    if limit == 0:
+        # still sent to get the result variables
+        yield offset, 0
+        return
+    page_offset = offset
+    while limit is None or page_offset < offset + limit:
+        yield page_offset, page_size if limit is None else min(page_size, offset + limit - page_offset)
+        page_offset += page_size
+
+def fetch_page(query, page_offset, page_limit):
+    # SPARQLWrapper instances hold the query as state and cannot be shared between workers
+    sparql_remote = create_remote(args)
+    page_query = f"{query}\nLIMIT {page_limit} OFFSET {page_offset}"
+    sparql_remote.setQuery(page_query)
+    columns, bindings = read_remote_result(remote_result_events(remote_response(sparql_remote, page_query)))
+    return columns, list(bindings)
+
+def read_remote_paged(full_sparql):
+    """fetches LIMIT/OFFSET pages concurrently, returns the result variables and an iterator over
+    the bindings of all pages in order"""
+    import concurrent.futures
+    query, limit, offset = split_limit_offset(full_sparql)
+    windows = page_windows(args.page_size, limit, offset)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.page_workers)
+    pending = collections.deque()
+
+    # page requests belong to the query worker of this thread and are closed when it is cancelled
+    worker = getattr(query_workers, "query", None)
+
+    def fetch_worker_page(page_offset, page_limit):
+        query_workers.query = worker
+        try:
+            return fetch_page(query, page_offset, page_limit)
+        finally:
+            query_workers.query = None
 
-        rich.print(table, file=sys.stdout)
+    def submit_next():
+        window = next(windows, None)
+        if window is not None:
+            pending.append((window, executor.submit(fetch_worker_page, *window)))
 
-    return list(completer_options)
+    def pages():
+        try:
+            while len(pending) > 0:
+                (page_offset, page_limit), future = pending.popleft()
+                columns, bindings = future.result()
+                vprint("\[paging]", f"offset {page_offset}: {len(bindings)} results")
+                yield columns, bindings
+                if len(bindings) < page_limit:
+                    break
+                submit_next()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
-def output_local_result(qres, query):
-    completer_options = set()
+    for _ in range(max(args.page_workers, 1)):
+        submit_next()
 
-    if args.output == "json" or args.output=="csv":
-        output_data = {'query': query}
-        output_data['bindings'] = [var.title() for var in qres.vars]
-        output_data['results'] = []
-        for row in qres:
-            rowvals = [rdflib_to_string(g, val) if val is not None else None for val in row]
-            rowdict = {}
-            for idx, val in enumerate(rowvals):
-                rowdict[output_data['bindings'][idx]] = val
-                if val is not None and str(val) != '':
-                    completer_options.add(str(val))
-            output_data['results'].append(rowdict)
+    page_iter = pages()
+    columns, first_bindings = next(page_iter, ([], []))
+    return columns, itertools.chain(first_bindings, itertools.chain.from_iterable(bindings for _, bindings in page_iter))
 
+# {'head': {'link': [], 'vars': ['a', 'b']}, 'results': {'distinct': False, 'ordered': True, 'bindings': [{'a': {'type': 'uri', 'value': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type'}, 'b': {'type': 'uri', 'value': 'http://www.openlinksw.com/schemas/virtcxml#FacetCategoryPattern'}}, {'a': {'type': 'uri', 'value': 'http://www.w3.org/2001/XMLSchema#anyURI'}, 'b': {'type': 'uri', 'value': 'http://www.w3.org/2000/01/rdf-schema#Datatype'}}, {'a': {'type': 'uri', 'value': 'http://www.w3.org/2001/XMLSchema#anyURI'}, 'b': {'type': 'uri', 'value': 'http://www.w3.org/2000/01/rdf-schema#Datatype'}}, {'a': {'type': 'uri', 'value': 'http://www.w3.org/2001/XMLSchema#boolean'}, 'b': {'type': 'uri', 'value': 'http://www.w3.org/2000/01/rdf-schema#Datatype'}}, {'a': {'type': 'uri', 'value': 'http://www.w3.org/2001/XMLSchema#boolean'}, 'b': {'type': 'uri', 'value': 'http://www.w3.org/2000/01/rdf-schema#Datatype'}}, {'a': {'type': 'uri', 'value': 'http://www.w3.org/2001/XMLSchema#date'}, 'b': {'type': 'uri', 'value': 'http://www.w3.org/2000/01/rdf-schema#Datatype'}}, {'a': {'type': 'uri', 'value': 'http://www.w3.org/2001/XMLSchema#date'}, 'b': {'type': 'uri', 'value': 'http://www.w3.org/2000/01/rdf-schema#Datatype'}}, {'a': {'type': 'uri', 'value': 'http://www.w3.org/2001/XMLSchema#dateTime'}, 'b': {'type': 'uri', 'value': 'http://www.w3.org/2000/01/rdf-schema#Datatype'}}, {'a': {'type': 'uri', 'value': 'http://www.w3.org/2001/XMLSchema#dateTime'}, 'b': {'type': 'uri', 'value': 'http://www.w3.org/2000/01/rdf-schema#Datatype'}}, {'a': {'type': 'uri', 'value': 'http://www.w3.org/2001/XMLSchema#double'}, 'b': {'type': 'uri', 'value': 'http://www.w3.org/2000/01/rdf-schema#Datatype'}}]}}
+def harvest_completer_options(rows, completer_options):
+    for rowvals in rows:
+        for val in rowvals:
+            if val is not None and str(val) != '':
+                completer_options.add(str(val))
+        yield rowvals
+
+def write_table(columns, rows, out):
+    import rich
+    import rich.table
+    if use_pager(out):
+        return page_table(columns, rows)
+
+    # rich measures every cell of a table before printing it, rows past the cap are only counted
+    rows = iter(rows)
+    shown_rows = list(itertools.islice(rows, args.max_rows)) if args.max_rows > 0 else list(rows)
+    row_count = len(shown_rows) + sum(1 for _ in rows)
+
+    title = f"{row_count} result" + ("s" if row_count > 1 else "")
+    caption = None
+    if row_count > len(shown_rows):
+        title = f"first {len(shown_rows)} of {title}"
+        caption = f"{row_count - len(shown_rows)} more rows not shown, raise --max-rows or use --output=csv"
+    table = rich.table.Table(title=title, caption=caption)
+    for var in columns:
+        table.add_column(var, justify="left", no_wrap=False)
+    for rowvals in shown_rows:
+        table.add_row(*rowvals)
+
+    rich.print(table, file=out)
+    return row_count
+
+def use_pager(out):
+    if not args.interactive or args.no_pager or out is not sys.stdout:
+        return False
+    if not (sys.stdin.isatty() and sys.stdout.isatty()):
+        return False
+    import importlib.util
+    return importlib.util.find_spec("termios") is not None
+
+def read_key(fd):
+    import select
+    # waits in short slices so a cancelled query worker is not stuck in a read
+    while not select.select([fd], [], [], 0.1)[0]:
+        pass
+    key = os.read(fd, 1)
+    if key == b"\x1b":
+        # escape sequences of arrow and page keys arrive together, a lone escape does not
+        while select.select([fd], [], [], 0.02)[0]:
+            key += os.read(fd, 1)
+            if key[-1:].isalpha() or key[-1:] == b"~":
+                break
+    return key.decode("utf-8", errors="replace")
+
+def page_table(columns, rows):
+    """shows a window of rows that fits the terminal, rows are fetched from the result as the window moves"""
+    import rich.console
+    import rich.table
+    import termios
+    import tty
+    term_console = rich.console.Console()
+    rows = iter(rows)
+    fetched = []
+    exhausted = False
+
+    def fetch(count):
+        nonlocal exhausted
+        while not exhausted and len(fetched) < count:
+            row = next(rows, None)
+            if row is None:
+                exhausted = True
+            else:
+                fetched.append(row)
+
+    def window_table(top, page_size, title=None, caption=None):
+        table = rich.table.Table(title=title, caption=caption, caption_justify="left")
+        for var in columns:
+            table.add_column(var, justify="left", no_wrap=True, overflow="ellipsis")
+        for rowvals in fetched[top:top + page_size]:
+            table.add_row(*rowvals)
+        return table
+
+    # title, header and borders take up PAGER_CHROME_LINES lines, one line per row
+    page_size = max(term_console.size.height - PAGER_CHROME_LINES, 1)
+    fetch(page_size + 1)
+    if exhausted and len(fetched) <= page_size:
+        term_console.print(window_table(0, page_size, title=f"{len(fetched)} result" + ("s" if len(fetched) > 1 else "")))
+        return len(fetched)
+
+    # time spent browsing results does not count towards the query timeout
+    worker = getattr(query_workers, "query", None)
+    if worker is not None:
+        worker.suspend_timeout()
+
+    stdin_fd = sys.stdin.fileno()
+    previous_mode = termios.tcgetattr(stdin_fd)
+    top = 0
+    try:
+        tty.setcbreak(stdin_fd)
+        while True:
+            page_size = max(term_console.size.height - PAGER_CHROME_LINES, 1)
+            fetch(top + page_size + 1)
+            top = max(min(top, len(fetched) - page_size), 0)
+            total = f"{len(fetched)}" if exhausted else f"{len(fetched)}+"
+            status = f"rows {top + 1}-{min(top + page_size, len(fetched))} of {total}   " + \
+                "space/b: page, j/k: line, g/G: start/end, q: quit"
+            term_console.clear()
+            term_console.print(window_table(top, page_size, caption=status))
+
+            key = read_key(stdin_fd)
+            if key in ["q", "Q", "\x1b"]:
+                break
+            elif key in [" ", "f", "\x1b[6~"]:
+                top += page_size
+            elif key in ["b", "\x1b[5~"]:
+                top -= page_size
+            elif key in ["j", "\n", "\x1b[B"]:
+                top += 1
+            elif key in ["k", "\x1b[A"]:
+                top -= 1
+            elif key in ["g", "\x1b[H"]:
+                top = 0
+            elif key in ["G", "\x1b[F"]:
+                fetch(float("inf"))
+                top = len(fetched)
+    finally:
+        termios.tcsetattr(stdin_fd, termios.TCSADRAIN, previous_mode)
+    fprint(f"{len(fetched)} result" + ("s" if len(fetched) > 1 else "") + ("" if exhausted else " fetched, more available"))
+    return len(fetched)
+
+def write_json(columns, rows, query, out):
+    # same layout as json.dumps(output_data, indent=2), written one row at a time
+    header = json.dumps({'query': query, 'bindings': columns}, indent=2)
+    out.write(header[:-2] + ',\n  "results": [')
+
+    row_count = 0
+    for rowvals in rows:
+        rowdict = dict(zip(columns, rowvals))
+        out.write(("\n" if row_count == 0 else ",\n") + textwrap.indent(json.dumps(rowdict, indent=2), "    "))
+        row_count += 1
+
+    out.write(("\n  ]" if row_count > 0 else "]") + "\n}\n")
+    return row_count
+
+def write_ndjson(columns, rows, out):
+    row_count = 0
+    for rowvals in rows:
+        out.write(json.dumps(dict(zip(columns, rowvals))) + "\n")
+        row_count += 1
+    return row_count
+
+def write_csv(columns, rows, out):
+    out.write("\t".join([f'"{var}"' for var in columns]) + "\n")
+    row_count = 0
+    for rowvals in rows:
+        out.write("\t".join([f'"{"" if val is None else val}"' for val in rowvals]) + "\n")
+        row_count += 1
+    return row_count
+
+def output_rows(columns, rows, query, out=None):
+    """write result rows as they are produced, returns completion candidates in interactive mode"""
+    if out is None:
+        out = sys.stdout
+    completer_options = set()
+    if args.interactive:
+        rows = harvest_completer_options(rows, completer_options)
+
+    with timed_phase("render"):
         if args.output == "json":
-            print(json.dumps(output_data, indent=2), file=sys.stdout)
+            row_count = write_json(columns, rows, query, out)
+        elif args.output == "ndjson":
+            row_count = write_ndjson(columns, rows, out)
+        elif args.output == "csv":
+            row_count = write_csv(columns, rows, out)
         else:
-            print("\t".join([f'"{var}"' for var in output_data['bindings']]), file=sys.stdout)
-            for row in output_data['results']:
-                print("\t".join([f'"{row[var]}"' for var in output_data['bindings']]), file=sys.stdout)
-    else:
-        table = rich.table.Table(title=f"{len(qres)} result" + ("s" if len(qres) > 1 else ""))
-        for var in qres.vars:
-            table.add_column(var.title(), justify="left", no_wrap=False)
-
-        for row in qres:
-            rowvals = [rdflib_to_string(g, val) if val is not None else None for val in row]
-            for val in rowvals:
-                if val is not None and str(val) != '':
-                    completer_options.add(str(val))
-            table.add_row(*rowvals)
+            row_count = write_table(columns, rows, out)
 
-        rich.print(table, file=sys.stdout)
+    timer = getattr(query_timers, "timer", None)
+    if timer is not None:
+        timer.rows = row_count
 
+    vprint(f"\[query complete]", f"{row_count} results")
     return list(completer_options)
 
-def exec_query(query):
-    lines = query.split("\n")
-    query = []
+def output_remote_result(g, columns, bindings, query, out=None):
+    rows = ([sparqlw_to_string(g, row.get(column)) for column in columns] for row in bindings)
+    return output_rows(columns, timed_rows("convert", rows), query, out)
+
+def output_local_result(qres, query, out=None):
+    return output_local_rows(qres.vars, qres, query, out)
+
+def output_local_rows(variables, solution_rows, query, out=None):
+    columns = [var.title() for var in variables]
+    rows = ([rdflib_to_string(g, val) if val is not None else None for val in row] \
+            for row in timed_rows("evaluate", solution_rows))
+    return output_rows(columns, timed_rows("convert", rows), query, out)
+
+def write_ntriples(triples, out):
+    from rdflib.plugins.serializers.nt import _nt_row
+    triple_count = 0
+    for triple in triples:
+        out.write(_nt_row(triple))
+        triple_count += 1
+    return triple_count
+
+def turtle_term(term):
+    import rdflib
+    if isinstance(term, rdflib.URIRef):
+        return get_prefix_index(g).n3(str(term))
+    if isinstance(term, rdflib.Literal):
+        return term.n3(g.namespace_manager)
+    return term.n3()
+
+def write_turtle(triples, out):
+    """turtle without a graph behind it, consecutive triples of a subject are joined with ;"""
+    import rdflib
+    for ns, nslong in g.namespace_manager.namespaces():
+        out.write(f"@prefix {ns}: <{nslong}> .\n")
+    out.write("\n")
+    triple_count = 0
+    previous_subject = None
+    for subject, predicate, obj in triples:
+        predicate_obj = f"{'a' if predicate == rdflib.RDF.type else turtle_term(predicate)} {turtle_term(obj)}"
+        if subject == previous_subject:
+            out.write(f" ;\n    {predicate_obj}")
+        else:
+            if previous_subject is not None:
+                out.write(" .\n")
+            out.write(f"{turtle_term(subject)} {predicate_obj}")
+        previous_subject = subject
+        triple_count += 1
+    if previous_subject is not None:
+        out.write(" .\n")
+    return triple_count
+
+def output_triples(triples, query, out=None):
+    """write the triples of a CONSTRUCT or DESCRIBE result as they are produced, other
+    output formats show them as subject, predicate and object rows"""
+    if args.output not in GRAPH_OUTPUTS:
+        rows = ([rdflib_to_string(g, term) for term in triple] for triple in triples)
+        return output_rows(["Subject", "Predicate", "Object"], timed_rows("convert", rows), query, out)
+
+    if out is None:
+        out = sys.stdout
+    with timed_phase("render"):
+        if args.output == "turtle":
+            triple_count = write_turtle(triples, out)
+        else:
+            # without graph names N-Quads lines are N-Triples lines
+            triple_count = write_ntriples(triples, out)
+
+    timer = getattr(query_timers, "timer", None)
+    if timer is not None:
+        timer.rows = triple_count
+    vprint("\[query complete]", f"{triple_count} triples")
+    return []
+
+def output_ntriples_lines(lines, out=None):
+    """passes N-Triples lines of a remote response through unparsed"""
+    if out is None:
+        out = sys.stdout
+    triple_count = 0
+    with timed_phase("render"):
+        for line in lines:
+            if line.strip() != "":
+                out.write(line)
+                triple_count += 1
+
+    timer = getattr(query_timers, "timer", None)
+    if timer is not None:
+        timer.rows = triple_count
+    vprint("\[query complete]", f"{triple_count} triples")
+    return []
+
+def query_form(query):
+    """SELECT, CONSTRUCT, DESCRIBE or ASK, whichever comes first outside of literals, IRIs and comments"""
+    match = QUERY_FORM.search(QUERY_TOKEN.sub(" ", query))
+    return match.group(1).upper() if match is not None else None
+
+def prepare_local_query(query):
+    import rdflib.plugins.sparql
+    # the graph's namespaces are what rdflib would bind for the raw query text as well
+    if prepared_queries is not None:
+        return prepared_queries.prepare(query, dict(g.namespaces()))
+    return rdflib.plugins.sparql.prepareQuery(query, initNs=dict(g.namespaces()))
+
+def local_solutions(prepared, graph):
+    from rdflib.plugins.sparql.evaluate import evalPart
+    from rdflib.plugins.sparql.sparql import QueryContext
+    if prepared.algebra.datasetClause:
+        raise Exception("FROM and FROM NAMED are not supported for CONSTRUCT and DESCRIBE queries on local files")
+    ctx = QueryContext(graph)
+    ctx.prologue = prepared.prologue
+    return evalPart(ctx, prepared.algebra.p)
+
+def resource_description(resource, graph):
+    """triples of a resource and, recursively, of the blank nodes it refers to (its concise bounded description)"""
+    import rdflib
+    pending = [resource]
+    described = set(pending)
+    while len(pending) > 0:
+        for triple in graph.triples((pending.pop(), None, None)):
+            yield triple
+            if isinstance(triple[2], rdflib.BNode) and triple[2] not in described:
+                described.add(triple[2])
+                pending.append(triple[2])
+
+def local_graph_triples(query, graph):
+    """triples of a local CONSTRUCT or DESCRIBE query, produced while the WHERE clause is
+    evaluated instead of being collected in a result graph first
+
+    A triple that several solutions produce is written more than once, which leaves the
+    graph the output describes unchanged."""
+    import rdflib
+    from rdflib.plugins.sparql import algebra, parser
+    from rdflib.plugins.sparql.evaluate import _fillTemplate
+
+    with timed_phase("parse"):
+        if query_form(query) == "CONSTRUCT":
+            prepared = prepare_local_query(query)
+            template = prepared.algebra.template or prepared.algebra.p.p.triples
+        else:
+            # rdflib does not evaluate DESCRIBE, the described terms are taken from the parse tree
+            parsed = parser.parseQuery(query)
+            describe = parsed[1]
+            prologue = algebra.translatePrologue(parsed[0], None, dict(g.namespaces()))
+            prepared = prepare_local_query(query) if "where" in describe else None
+            if "var" in describe:
+                terms = [prologue.absolutize(term) for term in describe["var"]]
+            else:
+                terms = list(prepared.algebra.PV)
+
+    def constructed():
+        for solution in local_solutions(prepared, graph):
+            yield from _fillTemplate(template, solution)
+
+    def described():
+        resources = [term for term in terms if not isinstance(term, rdflib.Variable)]
+        variables = [term for term in terms if isinstance(term, rdflib.Variable)]
+        if prepared is not None and len(variables) > 0:
+            solution_values = (solution.get(var) for solution in local_solutions(prepared, graph) for var in variables)
+            resources = itertools.chain(resources, solution_values)
+        seen = set()
+        for resource in resources:
+            if resource is None or isinstance(resource, rdflib.Literal) or resource in seen:
+                continue
+            seen.add(resource)
+            yield from resource_description(resource, graph)
+
+    return constructed() if query_form(query) == "CONSTRUCT" else described()
+
+def response_lines(response):
+    pending = b""
+    while True:
+        data = response.read(READ_SIZE)
+        if not data:
+            break
+        lines = (pending + data).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.decode("utf-8") + "\n"
+    if pending.strip() != b"":
+        yield pending.decode("utf-8") + "\n"
+
+def ntriples_triples(lines):
+    from rdflib.plugins.parsers.ntriples import W3CNTriplesParser
+
+    class TripleSink:
+        triple_value = None
+
+        def triple(self, subject, predicate, obj):
+            self.triple_value = (subject, predicate, obj)
+
+    sink = TripleSink()
+    parser = W3CNTriplesParser(sink)
+    bnode_context = {}
     for line in lines:
-        line = line.strip()
-        if line.upper().startswith("PREFIX "):
-            prefixdata = line.split(" ", 2)
-            if len(prefixdata) == 3:
-                g.namespace_manager.bind(prefixdata[1].strip(":"), prefixdata[2].strip("<>"), override=True)
-                rich.print("\[prefix]", prefixdata[1])
+        sink.triple_value = None
+        parser.line = line.rstrip("\r\n")
+        parser.parseline(bnode_context)
+        if sink.triple_value is not None:
+            yield sink.triple_value
+
+def output_remote_graph(full_sparql, out=None):
+    """streams the result of a remote CONSTRUCT or DESCRIBE query, N-Triples responses are
+    read line by line, other RDF formats have to be parsed as a whole"""
+    import rdflib
+    import SPARQLWrapper as sparqlw
+    sparql_remote = create_remote(args)
+    sparql_remote.setReturnFormat(sparqlw.TURTLE)
+    # content negotiation only, the format parameters would ask some endpoints for JSON-LD
+    sparql_remote.setOnlyConneg(True)
+    sparql_remote.setQuery(full_sparql)
+
+    query_start = time.time()
+    # graph results are not kept in the result cache, they are meant to be written out once
+    with timed_phase("request"):
+        raw_response = remote_query(sparql_remote, accept=GRAPH_ACCEPT)
+        response = TimedResponse(raw_response, query_start)
+    content_type = raw_response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    vprint("\[graph result]", content_type)
+
+    if content_type in ["application/n-triples", "text/plain"]:
+        lines = response_lines(response)
+        if args.output in ["nt", "nquads"]:
+            return output_ntriples_lines(lines, out)
+        return output_triples(timed_rows("decode", ntriples_triples(lines)), full_sparql, out)
+
+    graph_format = [graph_format for content_name, graph_format in GRAPH_CONTENT_FORMATS.items() \
+                    if content_name in content_type]
+    if len(graph_format) == 0:
+        raise Exception(f"endpoint answered with {content_type or 'no content type'}, not an RDF graph")
+    fprint("\[graph result]", f"endpoint answered with {content_type} instead of N-Triples, reading the complete result")
+    with timed_phase("decode"):
+        result_graph = rdflib.Graph()
+        body = b"".join(iter(lambda: response.read(READ_SIZE), b""))
+        result_graph.parse(data=body, format=graph_format[0])
+    return output_triples(iter(result_graph), full_sparql, out)
+
+def execute_query(query, out=None):
+    import rdflib
+    with timed_phase("prefixes"):
+        lines = query.split("\n")
+        query = []
+        for line in lines:
+            line = line.strip()
+            if line.upper().startswith("PREFIX "):
+                prefixdata = line.split(" ", 2)
+                if len(prefixdata) == 3:
+                    g.namespace_manager.bind(prefixdata[1].strip(":"), prefixdata[2].strip("<>"), override=True)
+                    invalidate_prefix_index()
+                    fprint("\[prefix]", prefixdata[1])
+                else:
+                    fprint("\[error]", "syntax: PREFIX prefix <iri>")
             else:
-                rich.print("[red]\[error][/red] syntax: PREFIX prefix <iri>")
-        else:
-            query.append(line)
+                query.append(line)
 
-    query = "\n".join(query)
-    query = query.strip()
+        query = "\n".join(query)
+        query = query.strip()
     if query == "":
         return []
 
+    graph_query = query_form(query) in GRAPH_QUERY_FORMS
+    if args.output in GRAPH_OUTPUTS and not graph_query:
+        raise Exception(f"{args.output} output needs a CONSTRUCT or DESCRIBE query")
+
     fprint("\[querying]")
     qres = None
-    if type(query_endpoint) is rdflib.Graph:
-        qres = query_endpoint.query(query)
-        vprint(f"\[query complete]", f"{len(qres)} results")
-        return output_local_result(qres, query)
+    if isinstance(query_endpoint, Federation):
+        return query_endpoint.execute(query, out)
+    local_graph = query_endpoint
+    if isinstance(query_endpoint, ScanEndpoint):
+        if not graph_query:
+            with timed_phase("parse"):
+                prepared = prepare_local_query(query)
+            scan_result = query_endpoint.select(prepared)
+            if scan_result is not None:
+                return output_local_rows(scan_result[0], scan_result[1], query, out)
+        local_graph = query_endpoint.full_graph()
+    if type(local_graph) is rdflib.Graph:
+        if graph_query:
+            return output_triples(timed_rows("evaluate", local_graph_triples(query, local_graph)), query, out)
+        with timed_phase("parse"):
+            prepared = prepare_local_query(query)
+        with timed_phase("evaluate"):
+            qres = local_graph.query(prepared)
+        return output_local_result(qres, query, out)
     else:
-        sparql_prefixes = "\n".join([f"PREFIX {ns}: <{nslong}>" \
-                                    for ns, nslong in g.namespace_manager.namespaces()])
-
-        full_sparql = sparql_prefixes + "\n" + query
-        query_endpoint.setQuery(full_sparql)
-        qres = query_endpoint.query()
-        qres = qres.convert()
-        qres_count = len(qres.get("results", {}).get("bindings", []))
-        vprint(f"\[query complete]", f"{qres_count} results")
-        return output_remote_result(g, qres, query)
+        with timed_phase("prefixes"):
+            sparql_prefixes = "\n".join([f"PREFIX {ns}: <{nslong}>" \
+                                        for ns, nslong in g.namespace_manager.namespaces()])
+            full_sparql = sparql_prefixes + "\n" + query
+
+        if graph_query:
+            return output_remote_graph(full_sparql, out)
+        if args.page_size > 0 and is_pageable(query):
+            # pages are fetched and decoded in worker threads, only the wait for them is timed
+            with timed_phase("network"):
+                columns, bindings = read_remote_paged(full_sparql)
+            bindings = timed_rows("network", bindings)
+        else:
+            # a wrapper per query, batch and daemon queries run in threads and the wrapper holds the query
+            sparql_remote = create_remote(args)
+            sparql_remote.setQuery(full_sparql)
+            query_start = time.time()
+            with timed_phase("request"):
+                response = TimedResponse(remote_response(sparql_remote, full_sparql), query_start)
+            with timed_phase("decode"):
+                columns, bindings = read_remote_result(remote_result_events(response), query_start)
+            bindings = timed_rows("decode", bindings)
+
+        completer_options = output_remote_result(g, columns, bindings, query, out)
+        if args.verbose:
+            vprint("\[connections]", remote_connection_stats())
+        return completer_options
+
+query_profiler = None
+
+def endpoint_sources():
+    """every source queries run against: the federated endpoints, the remote endpoint or the local files"""
+    if args.federated:
+        return args.endpoints
+    return [args.endpoint] if args.remote else args.files
+
+def exec_query(query, out=None):
+    """runs a query, with phase timings, metrics and profiling where enabled"""
+    global query_profiler
+    if not args.timing and not args.metrics and args.profile is None:
+        return execute_query(query, out)
+
+    import cProfile
+    timer = QueryTimer()
+    query_timers.timer = timer
+    if args.profile is not None and query_profiler is None:
+        query_profiler = cProfile.Profile()
+
+    error = None
+    try:
+        if args.profile is not None:
+            query_profiler.enable()
+        try:
+            return execute_query(query, out)
+        finally:
+            if args.profile is not None:
+                query_profiler.disable()
+    except Exception as ex:
+        error = ex
+        raise
+    finally:
+        query_timers.timer = None
+        if args.timing:
+            fprint("\[timing]", timer.summary())
+        if args.metrics:
+            metrics = {"event": "query",
+                       "endpoint": endpoint_sources(),
+                       "query_sha1": hashlib.sha1(query.encode("utf-8")).hexdigest(),
+                       "status": "ok" if error is None else "error",
+                       "rows": timer.rows,
+                       "seconds": round(timer.total(), 6),
+                       "phases": {name: round(seconds, 6) for name, seconds in timer.phases.items()}}
+            if error is not None:
+                metrics["error"] = f"{error}"
+            print(json.dumps(metrics), file=sys.stderr, flush=True)
+        if args.profile is not None:
+            # statistics accumulate over all queries of the session
+            query_profiler.dump_stats(args.profile)
+            vprint("\[profile]", f"written to {args.profile}")
+
+class QueryCancelled(Exception):
+    pass
+
+# the CancellableQuery a thread works for, remote responses are registered with it
+query_workers = threading.local()
+
+class CancellableQuery:
+    """runs exec_query in a worker thread, the calling thread cancels it on Ctrl-C or when
+    the timeout expires
+
+    Cancelling closes the open remote responses and interrupts local evaluation with an
+    asynchronous QueryCancelled exception in the worker. Requests that wait for the first
+    response byte time out at the deadline by themselves. A worker that does not stop within
+    QUERY_CANCEL_GRACE seconds, e.g. such a request after Ctrl-C, is abandoned and closes
+    its response once it arrives.
+    """
+    def __init__(self, query, out=None, timeout=0):
+        self.query = query
+        self.out = out
+        self.timeout = timeout
+        self.deadline = time.time() + timeout if timeout > 0 else None
+        self.reason = None
+        self.finished = False
+        self.responses = []
+        self.result = None
+        self.error = None
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def work(self):
+        query_workers.query = self
+        try:
+            try:
+                self.result = exec_query(self.query, self.out)
+            finally:
+                with self.lock:
+                    self.finished = True
+        except BaseException as ex:
+            self.error = ex
+        finally:
+            query_workers.query = None
+
+    def add_response(self, response):
+        with self.lock:
+            if self.reason is None:
+                self.responses.append(response)
+                return
+        close_response(response)
+        raise QueryCancelled(self.reason)
+
+    def suspend_timeout(self):
+        self.deadline = None
+
+    def cancel(self, reason):
+        import ctypes
+        with self.lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            responses = self.responses[:]
+            if not self.finished:
+                ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(self.thread.ident),
+                                                           ctypes.py_object(QueryCancelled))
+        for response in responses:
+            close_response(response)
+
+    def run(self):
+        self.thread = threading.Thread(target=self.work, name="query", daemon=True)
+        self.thread.start()
+        try:
+            while self.thread.is_alive():
+                self.thread.join(0.1)
+                if self.deadline is not None and time.time() >= self.deadline and self.thread.is_alive():
+                    self.cancel(f"timed out after {self.timeout:g}s")
+                    break
+        except KeyboardInterrupt:
+            self.cancel("cancelled")
+
+        if self.reason is not None:
+            self.thread.join(QUERY_CANCEL_GRACE)
+            if self.thread.is_alive():
+                vprint("\[cancel]", "query worker is still blocked, abandoned")
+            raise QueryCancelled(self.reason)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+def run_cancellable(query, out=None):
+    """exec_query in a worker that Ctrl-C (interactive mode) and --timeout cancel"""
+    if not args.interactive and args.timeout <= 0:
+        return exec_query(query, out)
+    return CancellableQuery(query, out, args.timeout).run()
 
 class SparqlCompleter:
-    def __init__(self):
+    """tab completion for keywords, namespace prefixes and values seen in query results
+
+    Candidates are kept in lists of (case-folded, original) pairs sorted by the folded
+    form, so a completion is a bisection followed by a scan over the matches. Result values
+    are merged in per query, each remembers in how many results it was seen and when it
+    was last seen. Above the memory budget the values with the lowest frequency, halved
+    every COMPLETION_HALF_LIFE queries since they were last seen, are evicted.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024):
         self.options = ['PREFIX',
                         'SELECT',
                         'WHERE',
@@ -327,84 +2375,296 @@ class SparqlCompleter:
                         '.help',
                         '.prefixes',
                         '.exit',
-                        '.edit']
-        self.dynamic_options = ['foo']
-        self.max_dynamic_option_count = 500
-
-    def get_options(self):
-        return self.options + \
-               [f"{ns}:" for ns, _ in g.namespace_manager.namespaces()] + \
-               self.dynamic_options
+                        '.edit',
+                        '.cache',
+                        '.timing',
+                        '.timeout',
+                        '.vocabulary',
+                        '.history']
+        self.max_bytes = max_bytes
+        self.matches = []
+
+        # keywords and namespace prefixes, rebuilt when the namespace bindings change
+        self.static_index = []
+        self.static_version = None
+
+        # result values: sorted index, option -> [frequency, last seen query] and their size
+        self.dynamic_index = []
+        self.dynamic_stats = {}
+        self.dynamic_bytes = 0
+        self.query_count = 0
+        # values are also added from the vocabulary prefetch thread, lookups read self.dynamic_index
+        # once and never see a list that is being modified
+        self.lock = threading.Lock()
+
+    def refresh_static_index(self):
+        version = (namespace_version, id(g))
+        if self.static_version == version:
+            return
+        options = self.options[:]
+        if g is not None:
+            options += [f"{ns}:" for ns, _ in g.namespace_manager.namespaces()]
+        self.static_index = sorted(set((option.casefold(), option) for option in options))
+        self.static_version = version
 
     def add_dynamic_options(self, new_options):
         if new_options is None:
             return
 
-        prev_options = list(set(self.dynamic_options) - set(new_options))
-        self.dynamic_options = prev_options + new_options
-        self.dynamic_options = self.dynamic_options[-self.max_dynamic_option_count:]
+        with self.lock:
+            self.merge_options(new_options)
+
+    def merge_options(self, new_options):
+        self.query_count += 1
+        added = []
+        for option in new_options:
+            stats = self.dynamic_stats.get(option)
+            if stats is not None:
+                stats[0] += 1
+                stats[1] = self.query_count
+                continue
+            self.dynamic_stats[option] = [1, self.query_count]
+            self.dynamic_bytes += sys.getsizeof(option) + COMPLETION_ENTRY_OVERHEAD
+            added.append((option.casefold(), option))
+
+        if len(added) > 0:
+            # the index and the new values are two sorted runs, sorting merges them in linear time
+            added.sort()
+            self.dynamic_index = sorted(self.dynamic_index + added)
+        if self.dynamic_bytes > self.max_bytes:
+            self.evict()
+
+    def option_score(self, option):
+        frequency, last_seen = self.dynamic_stats[option]
+        return frequency * 0.5 ** ((self.query_count - last_seen) / COMPLETION_HALF_LIFE)
+
+    def evict(self):
+        # evict down to 90% of the budget so the next few queries do not evict again
+        target_bytes = self.max_bytes * 0.9
+        evicted = set()
+        for option in sorted(self.dynamic_stats, key=self.option_score):
+            if self.dynamic_bytes <= target_bytes:
+                break
+            del self.dynamic_stats[option]
+            self.dynamic_bytes -= sys.getsizeof(option) + COMPLETION_ENTRY_OVERHEAD
+            evicted.add(option)
+        self.dynamic_index = [entry for entry in self.dynamic_index if entry[1] not in evicted]
+        vprint("\[completion]", f"evicted {len(evicted)} values, {len(self.dynamic_stats)} kept")
+
+    def prefix_matches(self, index, prefix, limit):
+        matches = []
+        # (prefix,) sorts before every (folded, option) pair whose folded form starts with prefix
+        for entry_idx in range(bisect.bisect_left(index, (prefix,)), len(index)):
+            folded, option = index[entry_idx]
+            if len(matches) >= limit or not folded.startswith(prefix):
+                break
+            matches.append(option)
+        return matches
 
     def complete(self, text, state):
-        response = None
-        all_options = self.get_options()
-
         if state == 0:
             # This is the first time for this text, so build a match list.
-            if text:
-                self.matches = [s for s in all_options if s and s.lower().startswith(text.lower())]
-            else:
-                self.matches = all_options[:]
-
+            self.refresh_static_index()
+            prefix = (text or "").casefold()
+            self.matches = self.prefix_matches(self.static_index, prefix, COMPLETION_MAX_MATCHES)
+            self.matches += self.prefix_matches(self.dynamic_index, prefix, COMPLETION_MAX_MATCHES - len(self.matches))
+
+        if state < len(self.matches):
+            return self.matches[state]
+        return None
+
+def vocabulary_cache_filename():
+    if args.remote:
+        source = args.endpoint
+    else:
+        _, source = graph_cache_key(args)
+    cache_key = hashlib.sha1(source.encode("utf-8")).hexdigest()
+    return os.path.join(os.path.expanduser(args.cache_dir), "vocabulary", cache_key + ".json")
+
+def remote_vocabulary(query, limit):
+    iris = []
+    for page_offset, page_limit in page_windows(VOCABULARY_PAGE_SIZE, limit, 0):
+        _, bindings = fetch_page(query, page_offset, page_limit)
+        iris += [binding["term"]["value"] for binding in bindings \
+                 if binding.get("term", {}).get("type") == "uri"]
+        if len(bindings) < page_limit:
+            break
+    return iris
+
+def distinct_iris(terms, limit):
+    import rdflib
+    iris = {}
+    for term in terms:
+        if isinstance(term, rdflib.URIRef):
+            iris[str(term)] = True
+            if len(iris) >= limit:
+                break
+    return list(iris)
+
+def local_vocabulary(g, limit):
+    import rdflib
+    classes = distinct_iris(g.objects(None, rdflib.RDF.type), limit)
+    # the compact store lists predicates from its POS index, other stores scan every triple
+    store_predicates = getattr(g.store, "predicates", None)
+    predicates = distinct_iris(store_predicates() if store_predicates is not None else g.predicates(), limit)
+    return {"classes": classes, "predicates": predicates}
+
+class VocabularyPrefetch:
+    """fetches the classes and predicates of the endpoint in a background thread and offers
+    them to tab completion, the result is kept in the cache directory per endpoint"""
+    def __init__(self, completer, limit):
+        self.completer = completer
+        self.limit = limit
+        self.status = "not loaded"
+        self.thread = None
+
+    def start(self, refresh=False):
+        if self.thread is not None and self.thread.is_alive():
+            return False
+        self.status = "loading"
+        self.thread = threading.Thread(target=self.run, args=(refresh,), name="vocabulary", daemon=True)
+        self.thread.start()
+        return True
+
+    def read_cache(self, cache_filename):
+        try:
+            with open(cache_filename, "rt", encoding="utf-8") as infile:
+                return json.load(infile)
+        except (OSError, ValueError):
+            return None
+
+    def write_cache(self, cache_filename, vocabulary):
+        os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
+        with open(cache_filename + ".tmp", "wt", encoding="utf-8") as outfile:
+            json.dump(vocabulary, outfile)
+        os.replace(cache_filename + ".tmp", cache_filename)
+
+    def fetch(self):
+        if args.federated:
+            raise Exception("not available for several endpoints")
+        if args.scan:
+            raise Exception("not available with --scan")
+        if not args.remote:
+            return local_vocabulary(g, self.limit)
+        return {kind: remote_vocabulary(query, self.limit) for kind, query in VOCABULARY_QUERIES.items()}
+
+    def run(self, refresh):
+        # runs while the prompt waits for input, so nothing is printed here, .vocabulary shows the status
         try:
-            response = self.matches[state]
-        except IndexError:
-            response = None
-        return response
+            cache_filename = vocabulary_cache_filename()
+            vocabulary = None if refresh else self.read_cache(cache_filename)
+            if vocabulary is not None:
+                source = "cached"
+            else:
+                self.status = "fetching"
+                fetch_start = time.time()
+                vocabulary = self.fetch()
+                self.write_cache(cache_filename, vocabulary)
+                source = f"fetched in {time.time() - fetch_start:.2f}s"
+
+            index = PrefixIndex(g)
+            self.completer.add_dynamic_options([index.compact(iri) for iri in \
+                                                vocabulary["classes"] + vocabulary["predicates"]])
+            self.status = f"{len(vocabulary['classes'])} classes, {len(vocabulary['predicates'])} predicates, {source}"
+        except Exception as err:
+            self.status = f"failed: {err}"
+
+class HistoryStore:
+    """query history in an SQLite database with one row per distinct query, keyed by the hash of
+    its text, and the use count, duration and status of its last run
+
+    Every query is written when it is submitted, sessions running at the same time share the
+    database. Only the most recent queries are read at startup."""
+    def __init__(self, filename, legacy_filename=None):
+        import sqlite3
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        created = not os.path.exists(filename)
+        self.db = sqlite3.connect(filename, timeout=5)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS history (query_sha1 TEXT PRIMARY KEY, query TEXT NOT NULL, " + \
+                        "last_used REAL NOT NULL, use_count INTEGER NOT NULL DEFAULT 1, last_seconds REAL, last_status TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS history_last_used ON history (last_used)")
+        if created and legacy_filename is not None and os.path.exists(legacy_filename):
+            self.import_file(legacy_filename)
+        self.db.commit()
+
+    def key(self, query):
+        return hashlib.sha1(query.encode("utf-8")).hexdigest()
+
+    def upsert(self, entries):
+        self.db.executemany("INSERT INTO history (query_sha1, query, last_used) VALUES (?, ?, ?) " + \
+                            "ON CONFLICT (query_sha1) DO UPDATE SET last_used = excluded.last_used, use_count = use_count + 1",
+                            [(self.key(query), query, used) for query, used in entries])
+
+    def import_file(self, legacy_filename):
+        """entries of a readline history file, multi-line queries were stored with HIST_CRLF"""
+        with open(legacy_filename, "rt", encoding="utf-8", errors="replace") as infile:
+            entries = [line.rstrip("\n").replace(HIST_CRLF, "\n") for line in infile]
+        # libedit writes a header line
+        entries = [entry for entry in entries if entry.strip() != "" and entry != "_HiStOrY_V2_"]
+        # the file is ordered from the oldest entry to the newest
+        import_time = time.time() - len(entries)
+        self.upsert([(entry, import_time + entry_idx) for entry_idx, entry in enumerate(entries)])
+        fprint("\[history]", f"imported {len(entries)} entries from {legacy_filename}")
+
+    def add(self, query):
+        self.upsert([(query, time.time())])
+        self.db.commit()
+
+    def record(self, query, seconds, status):
+        self.db.execute("UPDATE history SET last_seconds = ?, last_status = ? WHERE query_sha1 = ?",
+                        (seconds, status, self.key(query)))
+        self.db.commit()
+
+    def recent(self, limit):
+        """the most recently used queries, oldest first"""
+        rows = self.db.execute("SELECT query FROM history ORDER BY last_used DESC LIMIT ?", (limit,)).fetchall()
+        return [row[0] for row in reversed(rows)]
+
+    def search(self, text, limit):
+        """the most recently used queries that contain text, or start with it if it begins with ^"""
+        prefix = text.startswith("^")
+        text = text[1:] if prefix else text
+        pattern = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        rows = self.db.execute("SELECT query, use_count, last_used, last_seconds, last_status FROM history " + \
+                               "WHERE query LIKE ? ESCAPE '\\' ORDER BY last_used DESC LIMIT ?",
+                               (pattern if prefix else "%" + pattern, limit)).fetchall()
+        return list(reversed(rows))
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+history_store = None
 
 def readline_history_init():
-    hist_filename = os.path.expanduser(HIST_PATH)
-    if not os.path.exists(hist_filename):
-        os.makedirs(os.path.dirname(hist_filename))
+    global history_store
+    import readline
     try:
-        readline.read_history_file(hist_filename)
-        #if args.verbose:
-        #    fprint("\[history]", "read", readline.get_history_length(), "items")
-    except FileNotFoundError:
-        with open(hist_filename, 'wb') as outfile:
-            pass
-
-    readline_history_replace(HIST_CRLF, "\n")
-
-def readline_history_replace(text, replacement):
-    # print("readline_history_replace", json.dumps({"text": text, "replace": replacement}))
-    for history_index in range(readline.get_current_history_length()+1):
-        history_item = readline.get_history_item(history_index)
-        if history_item is None:
-            continue
-        # print("hist replace", history_index, history_item)
-        history_item = history_item.replace(text, replacement)
-        readline.replace_history_item(history_index - 1, history_item)
-        # print("hist replace", history_index, "after", readline.get_history_item(history_index))
-
+        history_store = HistoryStore(os.path.expanduser(HIST_DB_PATH), os.path.expanduser(HIST_PATH))
+    except Exception as err:
+        # e.g. a Python build without sqlite3, the session keeps its history in memory
+        fprint("\[history]", f"not saved: {err}")
+        return
+    for entry in history_store.recent(HIST_WINDOW):
+        readline.add_history(entry)
 
 def readline_teardown():
-    # if args.verbose:
-    #     fprint("history", "writing", readline.get_history_length(), "items")
-
-    readline_history_replace("\n", HIST_CRLF)
-    readline.write_history_file(os.path.expanduser(HIST_PATH))
-    # if args.verbose:
-    #     fprint("history", "written", readline.get_history_length(), "items")
+    if history_store is not None:
+        history_store.close()
 
 def readline_init():
+    import readline
     # readline functionality w/ history
     readline.set_auto_history(False) # manual history management
     readline_history_init()
-    readline.set_history_length(1000)
 
     readline.set_completer_delims(readline.get_completer_delims().replace(":", ""))
 
-    completer = SparqlCompleter()
+    completer = SparqlCompleter(int(args.completion_memory * 1024 * 1024))
     readline.set_completer(completer.complete)
 
     readline.parse_and_bind('tab: menu-complete complete')
@@ -415,36 +2675,149 @@ def readline_init():
 
 def load_query_from_file(query_from_file):
     if query_from_file == "":
-        rich.print("[red]\[error][/red] syntax: .file <filename>")
+        fprint("\[error]", "syntax: .file <filename>")
         in_query = None
     elif not os.path.exists(query_from_file):
-        rich.print("[red]\[error][/red] file not found:", query_from_file)
+        fprint("\[error]", "file not found:", query_from_file)
         in_query = None
     else:
         with open(query_from_file, "rt") as infile:
             in_query = infile.read().strip()
     return in_query
 
-def add_history(entry):
-    # remove duplicates
-    history_duplicates = []
-    history = set()
-    for history_index in range(readline.get_current_history_length()+1):
-        history_item = readline.get_history_item(history_index)
-        if history_item is None:
-            continue
-        if history_item not in history and history != entry:
-            history.add(history_item)
-        else:
-            # print("history duplicate", history_item)
-            history_duplicates.append(history_index - 1)
-
-    for duplicate_index in reversed(history_duplicates):
-        readline.remove_history_item(duplicate_index)
+class QueryWatcher:
+    """waits for saved query files, given as files or directories of *.sparql files
+
+    Uses inotify on the parent directories where available, editors that save by
+    renaming a new file over the old one are seen as well. Elsewhere the files are
+    polled with stat(). Bursts of events within WATCH_DEBOUNCE seconds are merged.
+    """
+    IN_CLOSE_WRITE = 0x08
+    IN_MOVED_TO = 0x80
+
+    def __init__(self, paths):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.inotify_fd = None
+        self.watch_dirs = {}
+        self.snapshot = self.stat_files()
+        try:
+            self.init_inotify()
+        except (OSError, AttributeError) as err:
+            vprint("\[watch]", f"inotify unavailable ({err}), polling every {WATCH_POLL_INTERVAL}s")
+            self.close()
+
+    def init_inotify(self):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.inotify_fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.inotify_fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        for path in self.paths:
+            watch_dir = path if os.path.isdir(path) else os.path.dirname(path)
+            if watch_dir in self.watch_dirs.values():
+                continue
+            watch_descriptor = libc.inotify_add_watch(self.inotify_fd, os.fsencode(watch_dir),
+                                                      self.IN_CLOSE_WRITE | self.IN_MOVED_TO)
+            if watch_descriptor < 0:
+                raise OSError(ctypes.get_errno(), f"{watch_dir}: {os.strerror(ctypes.get_errno())}")
+            self.watch_dirs[watch_descriptor] = watch_dir
+
+    def close(self):
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+
+    def is_watched(self, filename):
+        return filename in self.paths or \
+            (os.path.dirname(filename) in self.paths and filename.endswith(".sparql"))
+
+    def files(self):
+        """the query files currently covered by the watched paths"""
+        files = []
+        for path in self.paths:
+            if os.path.isdir(path):
+                files.extend([os.path.join(path, entry) for entry in sorted(os.listdir(path)) \
+                              if entry.endswith(".sparql")])
+            elif os.path.exists(path):
+                files.append(path)
+        return files
+
+    def stat_files(self):
+        snapshot = {}
+        for filename in self.files():
+            try:
+                file_stat = os.stat(filename)
+            except OSError:
+                continue
+            snapshot[filename] = (file_stat.st_mtime_ns, file_stat.st_size)
+        return snapshot
+
+    def read_events(self, timeout):
+        """files in the watched directories with events, watched or not, empty after the timeout"""
+        import select
+        import struct
+        changed = set()
+        if not select.select([self.inotify_fd], [], [], timeout)[0]:
+            return changed
+        data = os.read(self.inotify_fd, 65536)
+        offset = 0
+        while offset < len(data):
+            watch_descriptor, _, _, name_length = struct.unpack_from("iIII", data, offset)
+            name = data[offset + 16:offset + 16 + name_length].rstrip(b"\0")
+            offset += 16 + name_length
+            changed.add(os.path.join(self.watch_dirs.get(watch_descriptor, ""), os.fsdecode(name)))
+        return changed
+
+    def poll_changes(self, timeout):
+        if timeout is None:
+            timeout = WATCH_POLL_INTERVAL
+        time.sleep(timeout)
+        snapshot = self.stat_files()
+        changed = set([filename for filename, file_stat in snapshot.items() \
+                       if self.snapshot.get(filename) != file_stat])
+        self.snapshot = snapshot
+        return changed
+
+    def next_events(self, timeout):
+        if self.inotify_fd is not None:
+            return self.read_events(timeout)
+        return self.poll_changes(timeout)
+
+    def wait(self):
+        """block until at least one watched file was saved, returns the saved files"""
+        changed = set()
+        while len(changed) == 0:
+            changed = set(filter(self.is_watched, self.next_events(None)))
+
+        # editors write, rename and touch files and their swap or backup files in quick succession,
+        # any event restarts the wait for a quiet period, which is cut short if the events never stop
+        debounce_end = time.time() + WATCH_DEBOUNCE_MAX
+        while time.time() < debounce_end:
+            events = self.next_events(WATCH_DEBOUNCE)
+            if len(events) == 0:
+                break
+            changed.update(filter(self.is_watched, events))
+        return sorted([filename for filename in changed if os.path.exists(filename)])
 
+def add_history(entry):
+    import readline
+    # the readline window holds each query once, an earlier copy of the entry is moved to the end
+    for history_index in range(readline.get_current_history_length(), 0, -1):
+        if readline.get_history_item(history_index) == entry:
+            readline.remove_history_item(history_index - 1)
+            break
     readline.add_history(entry)
+    if readline.get_current_history_length() > HIST_WINDOW:
+        readline.remove_history_item(0)
+
+    if history_store is not None:
+        history_store.add(entry)
 
 def run_query(in_query, skip_history, completer):
+    import rich
+    import rich.syntax
+    import rich.console
     global console
     if in_query is None or type(in_query) is not str or in_query == "":
         return False
@@ -455,19 +2828,33 @@ def run_query(in_query, skip_history, completer):
     if not skip_history:
         add_history(in_query)
 
+    query_start = time.time()
+    status = "ok"
     try:
-        result_completer_options = exec_query(in_query)
+        result_completer_options = run_cancellable(in_query)
         if result_completer_options is not None and len(result_completer_options) > 0:
             completer.add_dynamic_options(result_completer_options)
+    except QueryCancelled as ex:
+        # the graph and the history are left as they are, only the query is dropped
+        status = "cancelled"
+        fprint("\[cancelled]", f"{ex}")
     except Exception as ex:
+        status = "error"
         fprint("\[error]", f"{ex}")
         if args.verbose:
             if console is None:
                 console = rich.console.Console()
             console.print_exception()
+
+    if not skip_history and history_store is not None:
+        history_store.record(in_query, time.time() - query_start, status)
     return True
 
 def start_interactive_mode():
+    import rich
+    import rich.pretty
+    import rich.syntax
+    import rich.traceback
     global console
 
     vprint("\[interactive mode]", "starting")
@@ -479,10 +2866,13 @@ def start_interactive_mode():
     rich.traceback.install()
 
     completer = readline_init()
+    vocabulary = VocabularyPrefetch(completer, args.vocabulary_limit)
+    if args.vocabulary:
+        vocabulary.start()
 
     cancelled = False
-    watched_file = None
-    watched_file_previous_content = None
+    watcher = None
+    watched_queries = None
 
     in_query = []
     while not cancelled:
@@ -492,23 +2882,28 @@ def start_interactive_mode():
             if type(in_query) is not list:
                 in_query = []
 
-            if watched_file is None:
+            if watcher is None:
                 line_prompt = prompt if len(in_query) == 0 else "… "
                 rich.print(line_prompt, end='\n' if line_prompt == prompt else '')
 
                 in_query.append(input())
             else:
-                in_query = load_query_from_file(watched_file)
-                if watched_file_previous_content is None or \
-                    watched_file_previous_content != in_query:
-                    skip_history = True
-                    if in_query is None:
+                # the first round runs every watched query once
+                if watched_queries is None:
+                    watched_queries = {}
+                    changed_files = watcher.files()
+                else:
+                    changed_files = watcher.wait()
+                for changed_file in changed_files:
+                    in_query = load_query_from_file(changed_file)
+                    # saving without changes does not re-run the query
+                    if in_query is None or watched_queries.get(changed_file) == in_query:
                         continue
-                    run_query(in_query, skip_history, completer)
-                    watched_file_previous_content = in_query
-                    in_query = []
-
-                time.sleep(1)
+                    watched_queries[changed_file] = in_query
+                    if len(watcher.paths) > 1 or os.path.isdir(watcher.paths[0]):
+                        fprint("\[watch]", changed_file)
+                    run_query(in_query, True, completer)
+                in_query = []
                 continue
 
             if in_query[-1].strip().lower() in [".prefixes", ".prefixes;"]:
@@ -522,8 +2917,76 @@ def start_interactive_mode():
                 in_query = []
                 continue
 
+            if in_query[-1].strip().lower() in [".cache", ".cache;", ".cache clear", ".cache clear;"]:
+                if not args.remote:
+                    if prepared_queries is None:
+                        fprint("\[query cache]", "disabled, enable with --query-cache-size")
+                    elif in_query[-1].strip().lower().startswith(".cache clear"):
+                        prepared_queries.clear()
+                        fprint("\[query cache]", "cleared")
+                    else:
+                        fprint("\[query cache]", prepared_queries.stats())
+                elif result_cache is None:
+                    fprint("\[result cache]", "disabled, enable with --result-cache-ttl")
+                elif in_query[-1].strip().lower().startswith(".cache clear"):
+                    result_cache.clear()
+                    fprint("\[result cache]", "cleared")
+                else:
+                    fprint("\[result cache]", result_cache.stats())
+                in_query = []
+                continue
+
+            if in_query[-1].strip().lower().rstrip(";").split(" ")[0] == ".timing":
+                timing_arg = in_query[-1].strip().lower().rstrip(";")[len(".timing"):].strip()
+                if timing_arg in ["on", "off"]:
+                    args.timing = timing_arg == "on"
+                elif timing_arg != "":
+                    fprint("\[error]", "syntax: .timing \[on|off]")
+                fprint("\[timing]", "on" if args.timing else "off")
+                in_query = []
+                continue
+
+            if in_query[-1].strip().lower().rstrip(";").split(" ")[0] == ".timeout":
+                timeout_arg = in_query[-1].strip().lower().rstrip(";")[len(".timeout"):].strip()
+                if timeout_arg in ["off", "0"]:
+                    args.timeout = 0
+                elif timeout_arg != "":
+                    try:
+                        args.timeout = max(float(timeout_arg.rstrip("s")), 0)
+                    except ValueError:
+                        fprint("\[error]", "syntax: .timeout \[seconds|off]")
+                fprint("\[timeout]", f"{args.timeout:g}s" if args.timeout > 0 else "off")
+                in_query = []
+                continue
+
+            if in_query[-1].strip().lower().rstrip(";").split(" ")[0] == ".vocabulary":
+                vocabulary_arg = in_query[-1].strip().lower().rstrip(";")[len(".vocabulary"):].strip()
+                if vocabulary_arg == "refresh":
+                    if not vocabulary.start(refresh=True):
+                        fprint("\[vocabulary]", "already fetching")
+                elif vocabulary_arg != "":
+                    fprint("\[error]", "syntax: .vocabulary \[refresh]")
+                fprint("\[vocabulary]", vocabulary.status)
+                in_query = []
+                continue
+
+            if in_query[-1].strip().lower().rstrip(";").split(" ")[0] == ".history":
+                history_arg = in_query[-1].strip().rstrip(";")[len(".history"):].strip()
+                if history_store is None:
+                    fprint("\[history]", "not available")
+                else:
+                    matches = history_store.search(history_arg, HIST_SEARCH_LIMIT)
+                    for entry, use_count, last_used, last_seconds, last_status in matches:
+                        last_run = f", {last_status} in {last_seconds:.2f}s" if last_seconds is not None else ""
+                        fprint("\[history]", time.strftime("%Y-%m-%d %H:%M", time.localtime(last_used)) + \
+                               f", used {use_count}x{last_run}")
+                        rich.print(rich.syntax.Syntax(entry, "sparql"))
+                    fprint("\[history]", f"{len(matches)} shown, {len(history_store)} queries")
+                in_query = []
+                continue
+
             if in_query[-1].strip().lower() in [".help", ".help;"]:
-                fprint("commands: .help, .exit, .edit, .file, .watch")
+                fprint("commands: .help, .exit, .edit, .file, .watch, .cache, .timing, .timeout, .vocabulary, .history")
                 in_query = []
                 continue
 
@@ -550,16 +3013,19 @@ def start_interactive_mode():
 
                 if in_query.startswith(".watch "):
                     add_history(in_query)
-                    query_from_file = in_query[len(".watch "):].strip(" \"'")
-                    query_from_file = os.path.expanduser(query_from_file)
-                    query_source_interactive = False
-                    in_query = load_query_from_file(query_from_file)
-                    skip_history = True
-                    if in_query is None:
+                    watch_paths = [os.path.expanduser(path) for path in shlex.split(in_query[len(".watch "):])]
+                    in_query = []
+                    missing_paths = [path for path in watch_paths if not os.path.exists(path)]
+                    if len(watch_paths) == 0:
+                        fprint("\[error]", "syntax: .watch <filename or directory> [...]")
+                        continue
+                    if len(missing_paths) > 0:
+                        fprint("\[error]", "file not found:", ", ".join(missing_paths))
                         continue
 
-                    fprint(f"\[watch] starting {query_from_file}")
-                    watched_file = query_from_file
+                    fprint(f"\[watch] starting {', '.join(watch_paths)}")
+                    watcher = QueryWatcher(watch_paths)
+                    watched_queries = None
                     continue
                 elif in_query.startswith(".file"):
                     add_history(in_query)
@@ -584,16 +3050,261 @@ def start_interactive_mode():
             fprint("[exit]")
             cancelled = True
         except KeyboardInterrupt:
-            if watched_file is not None:
-                fprint(f"\[watch] stopping {watched_file}")
-                watched_file = None
+            if watcher is not None:
+                fprint(f"\[watch] stopping {', '.join(watcher.paths)}")
+                watcher.close()
+                watcher = None
             continue
         finally:
             pass
 
+def daemon_key():
+    """the endpoints, the versions of the local files and the flags that change how they are loaded,
+    a daemon only answers clients with the key it was started with"""
+    if args.federated:
+        endpoints = [endpoint if remote else os.path.abspath(endpoint) for endpoint, remote in args.sources]
+    else:
+        endpoints = [args.endpoint] if args.remote else [os.path.abspath(filename) for filename in args.files]
+    files = []
+    for filename in args.files:
+        file_stat = os.stat(filename)
+        files.append([os.path.abspath(filename), file_stat.st_size, file_stat.st_mtime_ns])
+    key_data = [endpoints, files, args.format, args.store, args.scan]
+    return hashlib.sha1(json.dumps(key_data).encode("utf-8")).hexdigest()
+
+def daemon_socket_path():
+    if args.socket is not None:
+        return os.path.expanduser(args.socket)
+    return os.path.join(os.path.expanduser(args.cache_dir), "daemon", daemon_key()[:16] + ".sock")
+
+def daemon_send(conn_file, frame):
+    conn_file.write((json.dumps(frame) + "\n").encode("utf-8"))
+
+class DaemonOutput:
+    """stdout replacement that forwards query output to a daemon client in buffered frames"""
+    def __init__(self, conn_file, frame_size=65536):
+        self.conn_file = conn_file
+        self.frame_size = frame_size
+        self.buffer = []
+        self.buffered = 0
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.frame_size:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self.buffered > 0:
+            daemon_send(self.conn_file, {"out": "".join(self.buffer)})
+        self.buffer = []
+        self.buffered = 0
+
+    def isatty(self):
+        return False
+
+def request_namespaces(shared_graph, namespace_params):
+    """a graph that only holds the namespaces of the daemon and those of one client"""
+    import rdflib
+    request_graph = rdflib.Graph()
+    for prefix, namespace in shared_graph.namespaces():
+        request_graph.namespace_manager.bind(prefix, namespace, override=True, replace=True)
+    add_namespace_params(request_graph, namespace_params)
+    return request_graph
+
+def daemon_handle(conn, key):
+    global g
+    with conn, conn.makefile("rwb") as conn_file:
+        request = json.loads(conn_file.readline().decode("utf-8"))
+        if request.get("key") != key:
+            # changed files or other loading flags, the client loads the endpoint itself
+            vprint("\[daemon]", "declined a client with other files or flags")
+            daemon_send(conn_file, {"stale": True})
+            return
+        vprint("\[daemon]", "query", request.get("query", ""))
+
+        # per query flags of the client
+        defaults = {"output": args.output, "timeout": args.timeout, "dedup": args.dedup}
+        for name, default in defaults.items():
+            setattr(args, name, request.get(name, default))
+        # the client's prefixes and PREFIX lines are bound for this query only, binding them on the
+        # shared graph would change the output and prefixes of every later client
+        shared_graph = g
+        g = request_namespaces(shared_graph, request.get("prefixes", []))
+
+        exit_code = 0
+        daemon_stdout = DaemonOutput(conn_file)
+        try:
+            run_cancellable(request.get("query", ""), daemon_stdout)
+        except Exception as ex:
+            fprint("\[error]", f"{ex}")
+            daemon_stdout.flush()
+            daemon_send(conn_file, {"err": f"{ex}"})
+            exit_code = 1
+        finally:
+            for name, default in defaults.items():
+                setattr(args, name, default)
+            g = shared_graph
+            invalidate_prefix_index()
+
+        daemon_stdout.flush()
+        daemon_send(conn_file, {"exit": exit_code})
+
+def start_daemon():
+    socket_path = daemon_socket_path()
+    key = daemon_key()
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen()
+    atexit.register(os.unlink, socket_path)
+    # exit cleanly on SIGTERM so the socket file is removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    fprint("\[daemon]", f"listening on {socket_path}")
+
+    try:
+        while True:
+            conn, _ = server.accept()
+            try:
+                daemon_handle(conn, key)
+            except (OSError, ValueError) as ex:
+                vprint("\[daemon]", f"client error: {ex}")
+    except KeyboardInterrupt:
+        fprint("\[daemon]", "stopping")
+    finally:
+        server.close()
+
+def daemon_query(query, out=None):
+    """forward a query to a running daemon, returns the exit code or None if no daemon is available"""
+    socket_path = daemon_socket_path()
+    if not os.path.exists(socket_path):
+        return None
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except OSError as ex:
+        vprint("\[daemon]", f"not available: {ex}")
+        client.close()
+        return None
+
+    vprint("\[daemon]", f"forwarding to {socket_path}")
+    with client, client.makefile("rwb") as conn_file:
+        daemon_send(conn_file, {"query": query, "key": daemon_key(), "output": args.output,
+                                "timeout": args.timeout, "dedup": args.dedup, "prefixes": prefix_args})
+        conn_file.flush()
+        for line in conn_file:
+            frame = json.loads(line.decode("utf-8"))
+            if "stale" in frame:
+                vprint("\[daemon]", "started for other files or flags, not used")
+                return None
+            if "out" in frame:
+                (out or sys.stdout).write(frame["out"])
+            elif "err" in frame:
+                fprint("\[error]", frame["err"])
+            elif "exit" in frame:
+                return frame["exit"]
+    return 1
+
+BATCH_EXTENSIONS = {"table": "txt", "json": "json", "ndjson": "ndjson", "csv": "csv",
+                    "nt": "nt", "nquads": "nq", "turtle": "ttl"}
+
+def load_batch(batch_path):
+    if os.path.isdir(batch_path):
+        batch = []
+        for batch_filename in sorted(os.listdir(batch_path)):
+            if batch_filename.endswith(".sparql"):
+                batch_query = load_query_from_file(os.path.join(batch_path, batch_filename))
+                batch.append((batch_filename[:-len(".sparql")], batch_query))
+        return batch
+
+    with open(batch_path, "rt") as infile:
+        batch_queries = [batch_query.strip().rstrip(";").strip() for batch_query in re.split(r"\n\s*\n", infile.read())]
+    return [(f"query-{idx + 1:04d}", batch_query) for idx, batch_query in \
+            enumerate([batch_query for batch_query in batch_queries if batch_query != ""])]
+
+def run_batch_query(name, batch_query, output_filename):
+    query_start = time.time()
+    try:
+        with open(output_filename, "wt") as outfile:
+            run_cancellable(batch_query, outfile)
+        return name, time.time() - query_start, None
+    except Exception as ex:
+        return name, time.time() - query_start, f"{ex}"
+
+def batch_executor():
+    import rdflib
+    import concurrent.futures
+    import multiprocessing
+    if type(query_endpoint) is rdflib.Graph and "fork" in multiprocessing.get_all_start_methods():
+        # forked workers share the already loaded graph copy-on-write
+        return concurrent.futures.ProcessPoolExecutor(max_workers=args.batch_workers,
+                                                      mp_context=multiprocessing.get_context("fork"))
+    return concurrent.futures.ThreadPoolExecutor(max_workers=args.batch_workers)
+
+def run_batch():
+    import concurrent.futures
+    batch = load_batch(args.batch)
+    os.makedirs(args.batch_output, exist_ok=True)
+    fprint("\[batch]", f"{len(batch)} queries, {args.batch_workers} workers")
+
+    batch_start = time.time()
+    batch_results = []
+    with batch_executor() as executor:
+        futures = []
+        for name, batch_query in batch:
+            output_filename = os.path.join(args.batch_output, f"{name}.{BATCH_EXTENSIONS[args.output]}")
+            futures.append(executor.submit(run_batch_query, name, batch_query, output_filename))
+
+        for future in concurrent.futures.as_completed(futures):
+            name, duration, error = future.result()
+            if error is None:
+                fprint("\[batch]", f"{name} {duration:.3f}s")
+            else:
+                fprint("\[error]", f"{name} {duration:.3f}s {error}")
+            batch_results.append({"name": name, "seconds": duration, "error": error})
+
+    batch_results.sort(key=lambda batch_result: batch_result["name"])
+    failures = len([batch_result for batch_result in batch_results if batch_result["error"] is not None])
+    summary = {"endpoint": endpoint_sources(),
+               "total_seconds": time.time() - batch_start,
+               "queries": len(batch_results),
+               "failures": failures,
+               "results": batch_results}
+    with open(os.path.join(args.batch_output, "summary.json"), "wt") as outfile:
+        json.dump(summary, outfile, indent=2)
+
+    fprint("\[batch]", f"{len(batch_results)} queries, {failures} failed, {summary['total_seconds']:.3f}s total")
+    return failures
+
 def main():
-    if query is not None:
-        exec_query(query)
+    init_args()
+    # timings, metrics and profiles describe this process, forwarded queries would run in the daemon
+    instrumented = args.timing or args.metrics or args.profile is not None
+    output_file = None
+    if query is not None and args.output_file is not None:
+        output_file = open(args.output_file, "wt", encoding="utf-8")
+        atexit.register(output_file.close)
+    if query is not None and not args.no_daemon and not instrumented:
+        exit_code = daemon_query(query, output_file)
+        if exit_code is not None:
+            sys.exit(exit_code)
+
+    init_endpoint()
+    if args.serve:
+        start_daemon()
+    elif args.batch is not None:
+        sys.exit(1 if run_batch() > 0 else 0)
+    elif query is not None:
+        try:
+            run_cancellable(query, output_file)
+        except QueryCancelled as ex:
+            fprint("\[error]", f"query {ex}")
+            sys.exit(1)
         sys.exit(0)
     else:
         start_interactive_mode()
@@ -0,0 +1,273 @@
+"""index lookups in memory-mapped N-Triples and N-Quads files for sparqlcli
+
+A file is split into blocks of 64 KiB, every line belongs to the block it starts in.
+The index records which blocks contain a subject and which contain a predicate: the
+CRC32 of the term as written in the file and the block number are packed into one
+unsigned 64 bit value, all values of a kind are sorted in a flat array. A lookup is a
+bisection in the memory-mapped index followed by a scan of the lines of the listed
+blocks, so the file is never parsed as a whole. Hash collisions only add blocks to
+scan, the terms of a line are compared before it is parsed.
+
+The index is built in one pass over the file and stores the size and modification
+time of the file it was built from, it is rebuilt when they change.
+
+select_plan() accepts SELECT queries over a basic graph pattern with optional DISTINCT,
+LIMIT and OFFSET where every triple pattern has a bound subject or predicate once the
+patterns before it are matched. A triple is returned once for every line it occurs on.
+"""
+import os
+import mmap
+import time
+import zlib
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+
+from rdflib.term import URIRef, BNode, Literal, Variable
+from rdflib.plugins.parsers.ntriples import W3CNTriplesParser, r_wspace, r_wspaces
+
+INDEX_MAGIC = b"SPQSCAN1"
+# magic, file size, file mtime in ns, block size, subject and predicate value counts
+INDEX_HEADER = struct.Struct("<8sQQQQQ")
+BLOCK_SIZE = 64 * 1024
+BLOCK_BITS = 32
+BLOCK_MASK = (1 << BLOCK_BITS) - 1
+# the values are collected in buckets by the top byte of the hash and sorted one bucket at a time
+BUCKET_COUNT = 256
+# position of the indexed term in a line
+SUBJECT, PREDICATE = 0, 1
+
+class BNodeLabels(dict):
+    """bnode context that keeps the labels of the file, a bound blank node is looked up by its label"""
+    def get(self, bnode_id, default=None):
+        return bnode_id
+
+def term_token(term):
+    """the term as it is written in an N-Triples file, None for terms that cannot be a subject or predicate"""
+    if isinstance(term, URIRef):
+        return b"<" + term.encode("utf-8") + b">"
+    if isinstance(term, BNode):
+        return b"_:" + term.encode("utf-8")
+    return None
+
+def build_index(filename, index_filename, progress=None):
+    """writes the block index of a file, progress(bytes_done, file_size) is called about once a second"""
+    file_stat = os.stat(filename)
+    buckets = ([array("Q") for _ in range(BUCKET_COUNT)], [array("Q") for _ in range(BUCKET_COUNT)])
+    block_terms = (set(), set())
+    block = 0
+    offset = 0
+    progress_time = time.time()
+    with open(filename, "rb") as infile:
+        for line in infile:
+            if offset // BLOCK_SIZE != block:
+                block = offset // BLOCK_SIZE
+                block_terms[SUBJECT].clear()
+                block_terms[PREDICATE].clear()
+                if progress is not None and time.time() - progress_time >= 1.0:
+                    progress_time = time.time()
+                    progress(offset, file_stat.st_size)
+            offset += len(line)
+            terms = line.split(None, 2)
+            if len(terms) < 3 or terms[0].startswith(b"#"):
+                continue
+            for position in (SUBJECT, PREDICATE):
+                term_hash = zlib.crc32(terms[position])
+                if term_hash not in block_terms[position]:
+                    block_terms[position].add(term_hash)
+                    buckets[position][term_hash >> 24].append(term_hash << BLOCK_BITS | block)
+
+    with open(index_filename + ".tmp", "wb") as outfile:
+        outfile.write(INDEX_HEADER.pack(INDEX_MAGIC, file_stat.st_size, file_stat.st_mtime_ns, BLOCK_SIZE,
+                                        sum(len(bucket) for bucket in buckets[SUBJECT]),
+                                        sum(len(bucket) for bucket in buckets[PREDICATE])))
+        for position in (SUBJECT, PREDICATE):
+            for bucket_idx, bucket in enumerate(buckets[position]):
+                array("Q", sorted(bucket)).tofile(outfile)
+                buckets[position][bucket_idx] = None
+    os.replace(index_filename + ".tmp", index_filename)
+
+class ScanFile:
+    """a memory-mapped N-Triples or N-Quads file and its block index"""
+    def __init__(self, filename, index_filename, progress=None):
+        self.filename = filename
+        self.index_filename = index_filename
+        self.built = False
+        if not self.open_index():
+            os.makedirs(os.path.dirname(index_filename), exist_ok=True)
+            build_index(filename, index_filename, progress)
+            self.built = True
+            if not self.open_index():
+                raise Exception(f"cannot read the index {index_filename}")
+
+        with open(filename, "rb") as infile:
+            # an empty file cannot be mapped
+            self.data = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) if self.file_size > 0 else b""
+
+    def open_index(self):
+        """maps the index if it exists and matches the file, False otherwise"""
+        if not os.path.exists(self.index_filename):
+            return False
+        file_stat = os.stat(self.filename)
+        with open(self.index_filename, "rb") as infile:
+            header = infile.read(INDEX_HEADER.size)
+            if len(header) < INDEX_HEADER.size:
+                return False
+            magic, file_size, file_mtime, block_size, subject_count, predicate_count = INDEX_HEADER.unpack(header)
+            if magic != INDEX_MAGIC or file_size != file_stat.st_size or file_mtime != file_stat.st_mtime_ns:
+                return False
+            index_size = INDEX_HEADER.size + 8 * (subject_count + predicate_count)
+            if os.fstat(infile.fileno()).st_size != index_size:
+                return False
+            index_data = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        values = memoryview(index_data)[INDEX_HEADER.size:].cast("Q")
+        self.index_values = (values[:subject_count], values[subject_count:])
+        self.file_size = file_size
+        self.block_size = block_size
+        return True
+
+    def blocks(self, position, token):
+        """numbers of the blocks that may contain lines with the token at the position"""
+        values = self.index_values[position]
+        term_hash = zlib.crc32(token)
+        value_start = bisect_left(values, term_hash << BLOCK_BITS)
+        value_end = bisect_right(values, term_hash << BLOCK_BITS | BLOCK_MASK, value_start)
+        return [values[value_idx] & BLOCK_MASK for value_idx in range(value_start, value_end)]
+
+    def block_lines(self, block):
+        data = self.data
+        start = block * self.block_size
+        end = min(start + self.block_size, len(data))
+        if start > 0:
+            # the line that ends the previous block may reach into this one
+            start = data.find(b"\n", start - 1) + 1
+            if start == 0 or start >= end:
+                return []
+        # the last line that starts in the block ends after it
+        stop = data.find(b"\n", end - 1)
+        return data[start:stop if stop >= 0 else len(data)].split(b"\n")
+
+    def lines(self, position, token):
+        """lines that have the token as their subject or predicate"""
+        for block in self.blocks(position, token):
+            for line in self.block_lines(block):
+                terms = line.split(None, 2)
+                if len(terms) == 3 and terms[position] == token:
+                    yield line
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+def parse_line(parser, line):
+    """subject, predicate and object of a line, the graph of an N-Quads line is ignored"""
+    parser.line = line.decode("utf-8")
+    parser.eat(r_wspace)
+    subject = parser.subject(BNodeLabels())
+    parser.eat(r_wspaces)
+    predicate = parser.predicate()
+    parser.eat(r_wspaces)
+    return subject, predicate, parser.object(BNodeLabels())
+
+def order_patterns(triples):
+    """the triple patterns in an order in which each one has a bound subject or predicate
+    when it is matched, None if there is none"""
+    bound = set()
+    pending = list(triples)
+    ordered = []
+
+    def is_bound(term):
+        return not isinstance(term, Variable) or term in bound
+
+    while len(pending) > 0:
+        # a bound subject selects a few lines, a predicate alone possibly a large part of the file
+        candidates = [pattern for pattern in pending if is_bound(pattern[0])] or \
+                     [pattern for pattern in pending if is_bound(pattern[1])]
+        if len(candidates) == 0:
+            return None
+        pattern = candidates[0]
+        pending.remove(pattern)
+        ordered.append(pattern)
+        bound.update([term for term in pattern if isinstance(term, Variable)])
+    return ordered
+
+def select_plan(algebra):
+    """(variables, ordered patterns, distinct, offset, limit) of a query the index can answer, None otherwise"""
+    if algebra.name != "SelectQuery" or algebra.datasetClause:
+        return None
+    part = algebra.p
+    offset, limit = 0, None
+    if part.name == "Slice":
+        offset, limit = part.start or 0, part.length
+        part = part.p
+    distinct = part.name in ["Distinct", "Reduced"]
+    if distinct:
+        part = part.p
+    if part.name != "Project" or part.p.name != "BGP":
+        return None
+
+    for subject, predicate, obj in part.p.triples:
+        # blank nodes of the query and property paths are left to the query engine
+        if not isinstance(subject, (URIRef, Variable)) or not isinstance(predicate, (URIRef, Variable)) or \
+                not isinstance(obj, (URIRef, Literal, Variable)):
+            return None
+    patterns = order_patterns(part.p.triples)
+    if patterns is None:
+        return None
+    return part.PV, patterns, distinct, offset, limit
+
+class ScanQuery:
+    """evaluates a plan of select_plan() over the lines of scan files"""
+    def __init__(self, scan_files):
+        self.scan_files = scan_files
+        self.parser = W3CNTriplesParser()
+
+    def match(self, pattern):
+        """triples that match a pattern, unbound positions are variables"""
+        subject, predicate, obj = pattern
+        if not isinstance(subject, Variable):
+            position, token = SUBJECT, term_token(subject)
+        else:
+            position, token = PREDICATE, term_token(predicate)
+        if token is None:
+            return
+        for scan_file in self.scan_files:
+            for line in scan_file.lines(position, token):
+                triple = parse_line(self.parser, line)
+                if all(isinstance(term, Variable) or term == value for term, value in zip(pattern, triple)):
+                    yield triple
+
+    def solutions(self, patterns, bindings):
+        if len(patterns) == 0:
+            yield bindings
+            return
+        pattern = [bindings.get(term, term) if isinstance(term, Variable) else term for term in patterns[0]]
+        for triple in self.match(pattern):
+            solution = dict(bindings)
+            # a variable that occurs twice in the pattern has to match the same term
+            if all(solution.setdefault(term, value) == value \
+                   for term, value in zip(pattern, triple) if isinstance(term, Variable)):
+                yield from self.solutions(patterns[1:], solution)
+
+    def rows(self, plan):
+        variables, patterns, distinct, offset, limit = plan
+        seen = set()
+        skipped = 0
+        row_count = 0
+        if limit == 0:
+            return
+        for solution in self.solutions(patterns, {}):
+            row = tuple(solution.get(var) for var in variables)
+            if distinct:
+                if row in seen:
+                    continue
+                seen.add(row)
+            if skipped < offset:
+                skipped += 1
+                continue
+            row_count += 1
+            yield row
+            # stops before the next solution is searched for, which may take a scan of many blocks
+            if limit is not None and row_count >= limit:
+                return
@@ -0,0 +1,274 @@
+"""compact in-memory triple store for sparqlcli
+
+Every term is interned once as a plain string and referred to by an integer id. Added triples are
+appended to three id columns and turned into SPO, POS and OSP indexes on first read.
+Each index is a pair of flat arrays: the offsets of the rows of every first-position
+id and the remaining two ids of each triple packed into one unsigned 64 bit value,
+sorted within a row. A triple costs a few dozen bytes instead of the nested dicts of
+the rdflib memory stores, lookups on the second position are a bisection.
+
+Terms are turned back into rdflib terms when a triple is read, a cache keeps the
+recently used ones. The store holds a single graph, contexts are ignored.
+"""
+import sys
+import functools
+from array import array
+from bisect import bisect_left, bisect_right
+
+from rdflib.store import Store
+from rdflib.term import URIRef, BNode, Literal
+
+ID_BITS = 32
+ID_MASK = (1 << ID_BITS) - 1
+
+# position of the first, second and third id of each index in a (s, p, o) triple
+INDEX_ORDER = {"spo": (0, 1, 2), "pos": (1, 2, 0), "osp": (2, 0, 1)}
+
+TERM_CACHE_SIZE = 65536
+
+def encode_term(term):
+    """string key of a term, a fraction of the size of the rdflib term object"""
+    if isinstance(term, Literal):
+        # language tags compare case-insensitively in rdflib
+        return f'"{term}\x00{(term.language or "").lower()}\x00{term.datatype or ""}'
+    if isinstance(term, BNode):
+        return f"_{term}"
+    if isinstance(term, URIRef):
+        return f"<{term}"
+    return term
+
+@functools.lru_cache(maxsize=TERM_CACHE_SIZE)
+def decode_term(key):
+    if type(key) is not str:
+        return key
+    if key[0] == "<":
+        return URIRef(key[1:])
+    if key[0] == "_":
+        return BNode(key[1:])
+    lexical, language, datatype = key[1:].rsplit("\x00", 2)
+    return Literal(lexical, lang=language or None, datatype=URIRef(datatype) if datatype else None)
+
+class CompactStore(Store):
+    context_aware = False
+    formula_aware = False
+    graph_aware = False
+    transaction_aware = False
+
+    def __init__(self, configuration=None, identifier=None):
+        super(CompactStore, self).__init__(configuration)
+        self.identifier = identifier
+
+        self.__term_ids = {}
+        self.__terms = []
+
+        # triples added since the indexes were last built, as columns of ids
+        self.__pending = (array("I"), array("I"), array("I"))
+        # every triple ever added, duplicates included, counted without building the indexes
+        self.__added = 0
+        # index name -> (row offsets by first id, packed second << 32 | third ids)
+        self.__indexes = {name: (array("Q", [0]), array("Q")) for name in INDEX_ORDER}
+
+        self.__namespace = {}
+        self.__prefix = {}
+
+    def __intern(self, term):
+        return self.__intern_key(encode_term(term))
+
+    def __intern_key(self, key):
+        term_id = self.__term_ids.get(key)
+        if term_id is None:
+            term_id = len(self.__terms)
+            if term_id > ID_MASK:
+                raise OverflowError("compact store is limited to 2**32 distinct terms")
+            self.__terms.append(key)
+            self.__term_ids[key] = term_id
+        return term_id
+
+    def __term(self, term_id):
+        return decode_term(self.__terms[term_id])
+
+    def __build_index(self, name):
+        """merge the pending triples into an index, rows stay sorted and free of duplicates"""
+        offsets, values = self.__indexes[name]
+        first, second, third = [self.__pending[position] for position in INDEX_ORDER[name]]
+        term_count = len(self.__terms)
+
+        row_positions = array("Q", [0]) * (term_count + 1)
+        for key in range(len(offsets) - 1):
+            row_positions[key + 1] = offsets[key + 1] - offsets[key]
+        for key in first:
+            row_positions[key + 1] += 1
+        for key in range(term_count):
+            row_positions[key + 1] += row_positions[key]
+
+        # row_positions starts as the offset of every row and is advanced past each inserted value
+        new_values = array("Q", [0]) * row_positions[term_count]
+        for key in range(len(offsets) - 1):
+            row_start, row_end = offsets[key], offsets[key + 1]
+            new_values[row_positions[key]:row_positions[key] + row_end - row_start] = values[row_start:row_end]
+            row_positions[key] += row_end - row_start
+        for key, second_id, third_id in zip(first, second, third):
+            new_values[row_positions[key]] = second_id << ID_BITS | third_id
+            row_positions[key] += 1
+
+        new_offsets = array("Q", [0]) * (term_count + 1)
+        new_offsets[1:] = row_positions[:term_count]
+        offsets, values = new_offsets, new_values
+
+        duplicates = False
+        for key in range(term_count):
+            row_start, row_end = offsets[key], offsets[key + 1]
+            if row_end - row_start > 1:
+                row = sorted(values[row_start:row_end])
+                values[row_start:row_end] = array("Q", row)
+                duplicates = duplicates or any(value == next_value for value, next_value in zip(row, row[1:]))
+        if duplicates:
+            offsets, values = self.__compact_index(offsets, values, lambda key, value: True)
+        self.__indexes[name] = (offsets, values)
+
+    def __compact_index(self, offsets, values, keep):
+        """copy of an index without duplicate values and values rejected by keep(key, value)"""
+        new_offsets = array("Q", [0])
+        new_values = array("Q")
+        for key in range(len(offsets) - 1):
+            previous = None
+            for value_idx in range(offsets[key], offsets[key + 1]):
+                value = values[value_idx]
+                if value != previous and keep(key, value):
+                    new_values.append(value)
+                previous = value
+            new_offsets.append(len(new_values))
+        return new_offsets, new_values
+
+    def __index(self, name):
+        if len(self.__pending[0]) > 0:
+            for index_name in INDEX_ORDER:
+                self.__build_index(index_name)
+            self.__pending = (array("I"), array("I"), array("I"))
+        return self.__indexes[name]
+
+    def __scan(self, name, key, second=None, third=None):
+        offsets, values = self.__index(name)
+        if key >= len(offsets) - 1:
+            return
+        row_start, row_end = offsets[key], offsets[key + 1]
+        if second is not None:
+            row_start = bisect_left(values, second << ID_BITS | (0 if third is None else third), row_start, row_end)
+            row_end = bisect_right(values, second << ID_BITS | (ID_MASK if third is None else third), row_start, row_end)
+        for value_idx in range(row_start, row_end):
+            yield values[value_idx]
+
+    def add(self, triple, context, quoted=False):
+        """\
+        Add a triple to the store of triples.
+        """
+        subject, predicate, object = triple
+        subjects, predicates, objects = self.__pending
+        subjects.append(self.__intern(subject))
+        predicates.append(self.__intern(predicate))
+        objects.append(self.__intern(object))
+        self.__added += 1
+
+    def add_encoded(self, keys, ids):
+        """adds triples given as a table of encode_term() keys and three positions in it per triple,
+        each key is interned once instead of once per occurrence"""
+        term_ids = [self.__intern_key(key) for key in keys]
+        for position, column in enumerate(self.__pending):
+            column.extend([term_ids[key_idx] for key_idx in ids[position::3]])
+        self.__added += len(ids) // 3
+
+    def addN(self, quads):
+        for subject, predicate, object, context in quads:
+            self.add((subject, predicate, object), context)
+
+    def remove(self, triple_pattern, context=None):
+        # interned terms are kept, removing is a rebuild of every index
+        removed = set()
+        for triple, _ in self.triples(triple_pattern):
+            removed.add(tuple(self.__term_ids[encode_term(term)] for term in triple))
+        if len(removed) == 0:
+            return
+        for name, (first, second, third) in INDEX_ORDER.items():
+            offsets, values = self.__index(name)
+            def keep(key, value):
+                ids = [None, None, None]
+                ids[first], ids[second], ids[third] = key, value >> ID_BITS, value & ID_MASK
+                return tuple(ids) not in removed
+            self.__indexes[name] = self.__compact_index(offsets, values, keep)
+
+    def triples(self, triple_pattern, context=None):
+        """A generator over all the triples matching"""
+        ids = []
+        for term in triple_pattern:
+            if term is None:
+                ids.append(None)
+                continue
+            term_id = self.__term_ids.get(encode_term(term))
+            if term_id is None:  # a term that was never added cannot match
+                return
+            ids.append(term_id)
+        s, p, o = ids
+        term = self.__term
+
+        if s is not None and o is not None and p is None:  # subject+object given
+            for value in self.__scan("osp", o, s):
+                yield (term(s), term(value & ID_MASK), term(o)), self.__contexts()
+        elif s is not None:  # subject given, optionally with predicate and object
+            for value in self.__scan("spo", s, p, o):
+                yield (term(s), term(value >> ID_BITS), term(value & ID_MASK)), self.__contexts()
+        elif p is not None:  # predicate given, optionally with object, subject unbound
+            for value in self.__scan("pos", p, o):
+                yield (term(value & ID_MASK), term(p), term(value >> ID_BITS)), self.__contexts()
+        elif o is not None:  # object given, subject+predicate unbound
+            for value in self.__scan("osp", o):
+                yield (term(value >> ID_BITS), term(value & ID_MASK), term(o)), self.__contexts()
+        else:  # subject+predicate+object unbound
+            offsets, _ = self.__index("spo")
+            for s in range(len(offsets) - 1):
+                for value in self.__scan("spo", s):
+                    yield (term(s), term(value >> ID_BITS), term(value & ID_MASK)), self.__contexts()
+
+    def predicates(self):
+        """distinct predicates, read from the row offsets of the POS index"""
+        offsets, _ = self.__index("pos")
+        for key in range(len(offsets) - 1):
+            if offsets[key + 1] > offsets[key]:
+                yield self.__term(key)
+
+    def added_count(self):
+        """triples added so far including duplicates, len() builds the indexes to count distinct triples"""
+        return self.__added
+
+    def __len__(self, context=None):
+        offsets, _ = self.__index("spo")
+        return offsets[-1]
+
+    def footprint(self):
+        """approximate memory used by the indexes and the term dictionary, in bytes"""
+        index_bytes = 0
+        for name in INDEX_ORDER:
+            offsets, values = self.__index(name)
+            index_bytes += sys.getsizeof(offsets) + sys.getsizeof(values)
+        term_bytes = sys.getsizeof(self.__term_ids) + sys.getsizeof(self.__terms) + \
+            sum(sys.getsizeof(key) for key in self.__terms)
+        return {"triples": len(self), "terms": len(self.__terms),
+                "index_bytes": index_bytes, "term_bytes": term_bytes}
+
+    def bind(self, prefix, namespace, override=True):
+        if not override and (prefix in self.__namespace or namespace in self.__prefix):
+            return
+        self.__prefix[namespace] = prefix
+        self.__namespace[prefix] = namespace
+
+    def namespace(self, prefix):
+        return self.__namespace.get(prefix, None)
+
+    def prefix(self, namespace):
+        return self.__prefix.get(namespace, None)
+
+    def namespaces(self):
+        for prefix, namespace in self.__namespace.items():
+            yield prefix, namespace
+
+    def __contexts(self):
+        return (c for c in [])